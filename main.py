@@ -14,7 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from simulator.component import AndGate, NandGate, Input, Output
+from simulator.component import AndGate, NandGate, OrGate, NorGate, XorGate, Input, Clock, Output
 
 from simulator.display import Display
 
@@ -26,7 +26,7 @@ drawables.extend([Output((700, y)) for y in (300, )])
 
 display.drawables += drawables
 
-display.library += [AndGate((50,100)), NandGate((50,100)), Input((50,100)), Output((50,100))]
+display.library += [AndGate((50,100)), NandGate((50,100)), OrGate((50,100)), NorGate((50,100)), XorGate((50,100)), Input((50,100)), Clock((50,100)), Output((50,100))]
 
 while True:
     editor = display.edit()
@@ -0,0 +1,252 @@
+# Copyright 2024 - 2024, Michel Anders and the Digital Simulator contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# A backend does the actual work of a synchronous simulation step: evaluate every element with the
+# lookup table, gather the new inputs from the outputs and check if anything changed.
+# The engines of a Simulation (sync, event, levelized) decide *which* elements to evaluate, the backend
+# decides *how* a full step is computed, so both can be chosen independently.
+
+from abc import ABC, abstractmethod
+from importlib.util import find_spec
+
+import numpy as np
+
+# all available backends by name, see register()
+backends = {}
+
+
+def register(name):
+    """
+    Class decorator that makes a Backend available under the given name.
+    """
+
+    def decorator(cls):
+        cls.name = name
+        backends[name] = cls
+        return cls
+
+    return decorator
+
+
+def default_backend() -> str:
+    """
+    Return the name of the fastest available backend.
+    """
+    return "numba" if "numba" in backends else "numpy"
+
+
+def get_backend(name=None):
+    """
+    Return a new instance of the backend with the given name, or of the default backend if name is None.
+
+    If the default backend turns out to be unusable, the numpy backend is used instead.
+    """
+    if name is None:
+        try:
+            return get_backend(default_backend())
+        except ImportError:
+            return NumpyBackend()
+    if name not in backends:
+        raise ValueError(f"unknown simulation backend {name}")
+    return backends[name]()
+
+
+class Backend(ABC):
+    """
+    The interface between a Simulation and the code that evaluates its elements.
+
+    compile() is called with the netlist of the simulation every time it is (re)connected,
+    step() and settle() update the state arrays (input1, input2, output and _next_output) of the simulation itself.
+    Every backend must implement step(), settle() repeats it unless a backend has a faster way.
+    """
+
+    name = None
+
+    def compile(self, netlist):
+        """
+        Prepare for simulating the given netlist.
+        """
+        self.netlist = netlist
+
+    @abstractmethod
+    def step(self, simulation) -> bool:
+        """
+        Perform a single simulation step and return True if any output changed.
+        """
+
+    def settle(self, simulation, max_steps) -> int:
+        """
+        Run steps until no output changes anymore, or for at most max_steps steps, and return the number of steps taken.
+        """
+        simulation.settled = False
+        steps = 0
+        while steps < max_steps:
+            steps += 1
+            if not self.step(simulation):
+                simulation.settled = True
+                break
+        return steps
+
+
+@register("numpy")
+class NumpyBackend(Backend):
+    def step(self, simulation) -> bool:
+        """
+        Perform a single simulation step and return True if any output changed.
+
+        All intermediate results are written into preallocated arrays and the output
+        array is swapped with its double buffer, so no memory is allocated.
+        """
+        # booleans viewed as bytes are 0 or 1, so we can add them to form the index into the lookup table
+        input1 = simulation.input1.view(np.uint8)
+        input2 = simulation.input2.view(np.uint8)
+        state = simulation._state
+        np.add(input2, input2, out=state)
+        np.add(state, input1, out=state)
+        np.add(state, simulation.operation, out=state)
+
+        output = simulation._next_output
+        np.take(simulation.lookup, state, out=output, mode="clip")
+        np.take(output, simulation.inputmap1, out=simulation.input1, mode="clip")
+        np.take(output, simulation.inputmap2, out=simulation.input2, mode="clip")
+        simulation._gather_wide(output, simulation.input1, simulation.input2)
+
+        simulation._pending = None  # the event driven engine cannot tell what changed here
+        np.not_equal(simulation.output, output, out=simulation._changed)
+        simulation._next_output = simulation.output
+        simulation.output = output
+
+        return bool(simulation._changed.any())
+
+
+def _settle_loop(
+    lookup,
+    operation,
+    inputmap1,
+    inputmap2,
+    wide,
+    wide_ptr,
+    wide_inputs,
+    wide_reduction,
+    input1,
+    input2,
+    output,
+    next_output,
+    max_steps,
+):
+    """
+    Run synchronous steps until no output changes, or for at most max_steps steps.
+
+    Returns the number of steps taken and whether the last step changed anything.
+    After an odd number of steps the newest outputs are in next_output.
+    This is plain Python, it is only fast once compiled by numba, see _kernel().
+    """
+    n = output.size
+    steps = 0
+    changed = True
+    while changed and steps < max_steps:
+        steps += 1
+        changed = False
+        # evaluate and compare in the same pass
+        for i in range(n):
+            value = lookup[input1[i] + 2 * input2[i] + operation[i]]
+            if value != output[i]:
+                changed = True
+            next_output[i] = value
+        for i in range(n):
+            input1[i] = next_output[inputmap1[i]]
+            input2[i] = next_output[inputmap2[i]]
+        # gates with more than 2 inputs, see Simulation._gather_wide() (reduction 0 = AND, 1 = OR, 2 = XOR)
+        for g in range(wide.size):
+            reduction = wide_reduction[g]
+            value = next_output[wide_inputs[wide_ptr[g]]]
+            for j in range(wide_ptr[g] + 1, wide_ptr[g + 1]):
+                other = next_output[wide_inputs[j]]
+                if reduction == 0:
+                    value = value and other
+                elif reduction == 1:
+                    value = value or other
+                else:
+                    value = value != other
+            input1[wide[g]] = value
+            input2[wide[g]] = value and reduction != 2
+        output, next_output = next_output, output
+    return steps, changed
+
+
+# the compiled version of _settle_loop(), see _kernel()
+_settle_kernel = None
+
+
+def _kernel():
+    """
+    Return _settle_loop() compiled by numba.
+
+    numba takes a noticeable time to import, so that only happens when the numba backend is actually used.
+    """
+    global _settle_kernel
+    if _settle_kernel is None:
+        import numba
+
+        _settle_kernel = numba.njit(cache=True, nogil=True)(_settle_loop)
+    return _settle_kernel
+
+
+if find_spec("numba") is not None:  # the numba backend is optional
+
+    @register("numba")
+    class NumbaBackend(Backend):
+        """
+        Runs whole settle loops in a single compiled function.
+
+        A step evaluates, compares and gathers in plain loops without temporary arrays,
+        and the loop stops as soon as a step changes nothing without returning to Python in between.
+        """
+
+        def __init__(self):
+            self.kernel = _kernel()
+
+        def compile(self, netlist):
+            super().compile(netlist)
+            # compile the kernel for the types of these arrays now, instead of on the first step
+            scratch = np.zeros(netlist.n, dtype=bool)
+            self._run(netlist, scratch, scratch, scratch, scratch, 0)
+
+        def _run(self, netlist, input1, input2, output, next_output, max_steps):
+            return self.kernel(
+                netlist.lookup,
+                netlist.operation,
+                netlist.inputmap1,
+                netlist.inputmap2,
+                netlist.wide,
+                netlist.wide_ptr,
+                netlist.wide_inputs,
+                netlist.wide_reduction,
+                input1,
+                input2,
+                output,
+                next_output,
+                max_steps,
+            )
+
+        def _advance(self, simulation, max_steps):
+            steps, changed = self._run(
+                self.netlist,
+                simulation.input1,
+                simulation.input2,
+                simulation.output,
+                simulation._next_output,
+                max_steps,
+            )
+            if steps % 2:
+                simulation.output, simulation._next_output = simulation._next_output, simulation.output
+            simulation._pending = None  # the event driven engine cannot tell what changed here
+            return steps, changed
+
+        def step(self, simulation) -> bool:
+            return self._advance(simulation, 1)[1]
+
+        def settle(self, simulation, max_steps) -> int:
+            steps, changed = self._advance(simulation, max_steps)
+            simulation.settled = not changed
+            return steps
@@ -0,0 +1,327 @@
+# Copyright 2024 - 2024, Michel Anders and the Digital Simulator contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# A binary companion to the .dsim format, for circuits too large to parse as JSON one component at a time.
+#
+# A .dsimb file starts with a small header: the magic bytes, a format version and a JSON directory
+# that lists every array with its dtype, shape and offset. The arrays follow as raw little-endian data,
+# each aligned on 64 bytes, so the whole file is mapped into memory once and every array is a view of it.
+#
+# The drawables and the library each get a set of arrays with a type code, position, end point (for Lines),
+# angle, inputs, period, phase and the labels as UTF-8 bytes with offsets, together with a flag for components
+# without a label, which get their default label when loaded. A netlist can be stored as well,
+# so a Simulation can be created without connecting the components first.
+#
+# Convert between the formats with:
+#
+#   python -m simulator.binary circuit.dsim circuit.dsimb
+#   python -m simulator.binary circuit.dsimb circuit.dsim
+
+import argparse
+import inspect
+import json
+import struct
+import sys
+
+import numpy as np
+
+EXT = ".dsimb"
+MAGIC = b"DSIMBIN\0"
+# increase when the layout of the arrays changes
+VERSION = 2
+ALIGNMENT = 64
+# the type codes of the components
+TYPES = ("AndGate", "NandGate", "OrGate", "NorGate", "XorGate", "Input", "Clock", "Output", "Line")
+SECTIONS = ("drawables", "library")
+
+_header = struct.Struct("<8sII")
+
+
+def _number(value):
+    # integral values come back as ints, like they were saved
+    return int(value) if float(value).is_integer() else float(value)
+
+
+def _numbers(array) -> list:
+    # _number() applied to every value of an array, as (nested) lists
+    if np.all(np.mod(array, 1) == 0):
+        return array.astype(np.int64).tolist()
+    return np.vectorize(_number, otypes=[object])(array).tolist()
+
+
+def _labels(arrays, section, indices=None) -> list:
+    # the labels of the components of a section, or only of those at the given indices
+    data = arrays[f"{section}.labels"].tobytes()
+    offsets = arrays[f"{section}.label_offsets"]
+    if indices is None:
+        starts, ends = offsets[:-1].tolist(), offsets[1:].tolist()
+    else:
+        starts, ends = offsets[indices].tolist(), offsets[indices + 1].tolist()
+    if data.isascii():
+        # byte offsets are character offsets, so the labels are slices of a single string
+        text = data.decode()
+        return [text[start:end] for start, end in zip(starts, ends)]
+    return [data[start:end].decode() for start, end in zip(starts, ends)]
+
+
+def encode(obj) -> dict:
+    """
+    Return the arrays that hold a decoded .dsim file, i.e. a dict with lists of drawables and library components.
+    """
+    arrays = {}
+    for section in SECTIONS:
+        entries = obj.get(section, [])
+        n = len(entries)
+        kind = np.zeros(n, dtype=np.uint8)
+        pos = np.zeros((n, 2), dtype=np.float64)
+        end = np.zeros((n, 2), dtype=np.float64)
+        angle = np.zeros(n, dtype=np.float64)
+        inputs = np.full(n, 2, dtype=np.int32)
+        period = np.full(n, 2, dtype=np.int64)
+        phase = np.zeros(n, dtype=np.int64)
+        labelled = np.zeros(n, dtype=np.uint8)
+        labels = []
+        for index, entry in enumerate(entries):
+            parameters = entry["dict"]
+            kind[index] = TYPES.index(entry["type"])
+            if entry["type"] == "Line":
+                pos[index] = parameters["start"]
+                end[index] = parameters["end"]
+            else:
+                pos[index] = parameters["pos"]
+            angle[index] = parameters.get("angle", 0)
+            inputs[index] = parameters.get("inputs", 2)
+            period[index] = parameters.get("period", 2)
+            phase[index] = parameters.get("phase", 0)
+            # a missing label is not the same as an empty one: the component gets its default label
+            labelled[index] = "label" in parameters
+            labels.append(parameters.get("label", "").encode())
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(label) for label in labels], out=offsets[1:])
+        arrays |= {
+            f"{section}.type": kind,
+            f"{section}.pos": pos,
+            f"{section}.end": end,
+            f"{section}.angle": angle,
+            f"{section}.inputs": inputs,
+            f"{section}.period": period,
+            f"{section}.phase": phase,
+            f"{section}.label_offsets": offsets,
+            f"{section}.labels": np.frombuffer(b"".join(labels), dtype=np.uint8),
+            f"{section}.labelled": labelled,
+        }
+    return arrays
+
+
+def decode(arrays) -> dict:
+    """
+    Return the decoded .dsim file held by the arrays, the inverse of encode().
+    """
+    obj = {}
+    for section in SECTIONS:
+        columns = zip(
+            arrays[f"{section}.type"].tolist(),
+            _numbers(arrays[f"{section}.pos"]),
+            _numbers(arrays[f"{section}.end"]),
+            _numbers(arrays[f"{section}.angle"]),
+            arrays[f"{section}.inputs"].tolist(),
+            arrays[f"{section}.period"].tolist(),
+            arrays[f"{section}.phase"].tolist(),
+            _labels(arrays, section),
+            arrays[f"{section}.labelled"].tolist(),
+        )
+        entries = []
+        for kind, pos, end, angle, inputs, period, phase, label, labelled in columns:
+            kind = TYPES[kind]
+            # the same parameters, in the same order, as the parameters() of the components in model.py
+            if kind == "Line":
+                parameters = {"start": pos, "end": end, "angle": angle, "label": label}
+            else:
+                parameters = {"pos": pos, "angle": angle, "label": label}
+            if not labelled:
+                del parameters["label"]
+            if kind != "Line":
+                if kind == "Clock":
+                    parameters |= {"period": period, "phase": phase}
+                elif kind not in ("Input", "Output") and inputs != 2:
+                    parameters["inputs"] = inputs
+            entries.append({"type": kind, "dict": parameters})
+        obj[section] = entries
+    return obj
+
+
+def components(arrays, section="drawables") -> list:
+    """
+    Return the components of model.py held by the arrays of a section, the same as model.load(decode(arrays)).
+    """
+    from simulator import model
+
+    classes = [getattr(model, name) for name in TYPES]
+    defaults = [inspect.signature(cls).parameters["label"].default for cls in classes]
+    line, clock = TYPES.index("Line"), TYPES.index("Clock")
+    gates = {TYPES.index(name) for name in TYPES if issubclass(getattr(model, name), model.Gate)}
+    columns = zip(
+        arrays[f"{section}.type"].tolist(),
+        _numbers(arrays[f"{section}.pos"]),
+        _numbers(arrays[f"{section}.end"]),
+        _numbers(arrays[f"{section}.angle"]),
+        arrays[f"{section}.inputs"].tolist(),
+        arrays[f"{section}.period"].tolist(),
+        arrays[f"{section}.phase"].tolist(),
+        _labels(arrays, section),
+        arrays[f"{section}.labelled"].tolist(),
+    )
+    result = []
+    for kind, pos, end, angle, inputs, period, phase, label, labelled in columns:
+        if not labelled:
+            label = defaults[kind]
+        if kind in gates:
+            result.append(classes[kind](pos, angle, label, None, inputs))
+        elif kind == line:
+            result.append(classes[kind](pos, end, angle, label))
+        elif kind == clock:
+            result.append(classes[kind](pos, angle, label, None, period, phase))
+        else:
+            result.append(classes[kind](pos, angle, label))
+    return result
+
+
+def terminals(arrays, section="drawables") -> list:
+    """
+    Return the type and label of the Input, Clock and Output components of a section, in their order in the file.
+
+    No components are built, which is all a netlist stored in the same file needs to be driven and read.
+    """
+    from simulator import model
+
+    kinds = arrays[f"{section}.type"]
+    indices = np.flatnonzero(np.isin(kinds, [TYPES.index(name) for name in ("Input", "Clock", "Output")]))
+    labelled = arrays[f"{section}.labelled"][indices].tolist()
+    result = []
+    for kind, label, has_label in zip(kinds[indices].tolist(), _labels(arrays, section, indices), labelled):
+        if not has_label:
+            label = inspect.signature(getattr(model, TYPES[kind])).parameters["label"].default
+        result.append((TYPES[kind], label))
+    return result
+
+
+def write(path, arrays):
+    """
+    Write named arrays to a file in the .dsimb layout.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    for name, array in arrays.items():
+        arrays[name] = array.astype(array.dtype.newbyteorder("<"), copy=False)
+    # the directory holds the offsets of the arrays, which depend on the size of the directory itself
+    offset = 0
+    while True:
+        directory = []
+        position = _align(_header.size + offset)
+        for name, array in arrays.items():
+            directory.append([name, array.dtype.str, list(array.shape), position])
+            position = _align(position + array.nbytes)
+        text = json.dumps(directory).encode()
+        if len(text) <= offset:
+            break
+        offset = len(text)
+    with open(path, "wb") as f:
+        f.write(_header.pack(MAGIC, VERSION, offset))
+        f.write(text.ljust(offset))
+        for (name, _, _, position), array in zip(directory, arrays.values()):
+            f.write(b"\0" * (position - f.tell()))
+            f.write(array.tobytes())
+
+
+def _align(position) -> int:
+    return -(-position // ALIGNMENT) * ALIGNMENT
+
+
+def read(path) -> dict:
+    """
+    Return the named arrays of a .dsimb file as read-only views of the memory mapped file.
+    """
+    with open(path, "rb") as f:
+        header = f.read(_header.size)
+        if len(header) < _header.size or not header.startswith(MAGIC):
+            raise ValueError(f"{path} is not a {EXT} file")
+        _, version, length = _header.unpack(header)
+        if version != VERSION:
+            raise ValueError(f"{path} has version {version} of the {EXT} format, expected {VERSION}")
+        directory = json.loads(f.read(length))
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    arrays = {}
+    for name, dtype, shape, position in directory:
+        dtype = np.dtype(dtype)
+        size = dtype.itemsize * int(np.prod(shape))
+        arrays[name] = data[position : position + size].view(dtype).reshape(shape)
+    return arrays
+
+
+def save(path, obj, netlist=None):
+    """
+    Save a decoded .dsim file, together with the arrays of a Netlist if one is given.
+    """
+    arrays = encode(obj)
+    if netlist is not None:
+        arrays |= {f"netlist.{name}": getattr(netlist, name) for name in netlist.fields}
+    write(path, arrays)
+
+
+def load(path) -> dict:
+    """
+    Return the decoded .dsim file that is stored in a .dsimb file.
+    """
+    return decode(read(path))
+
+
+def load_netlist(path):
+    """
+    Return the Netlist stored in a .dsimb file, or None if it holds only components.
+    """
+    return decode_netlist(read(path))
+
+
+def decode_netlist(arrays):
+    """
+    Return the Netlist held by the arrays of a .dsimb file, or None if they hold only components.
+    """
+    from simulator.simulation import Netlist
+
+    if "netlist.operation" not in arrays:
+        return None
+    return Netlist(**{name: arrays[f"netlist.{name}"] for name in Netlist.fields})
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m simulator.binary",
+        description=f"Convert a circuit between the .dsim and the binary {EXT} format.",
+    )
+    parser.add_argument("source", help=f"a .dsim or {EXT} file")
+    parser.add_argument("target", help="the file to write, in the other format")
+    parser.add_argument(
+        "--netlist", action="store_true", help=f"also store the connected netlist in the {EXT} file"
+    )
+    args = parser.parse_args(argv)
+
+    if args.source.endswith(EXT):
+        with open(args.target, "w") as f:
+            json.dump(load(args.source), f, indent=4)
+        return 0
+
+    with open(args.source) as f:
+        obj = json.load(f)
+    netlist = None
+    if args.netlist:
+        from simulator import model
+        from simulator.simulation import Simulation
+
+        simulation = Simulation(model.load(obj), collapse=True, backend="numpy")
+        simulation.connect()
+        netlist = simulation.netlist()
+    save(args.target, obj, netlist)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+# Copyright 2024 - 2024, Michel Anders and the Digital Simulator contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# A cache on disk of connected netlists.
+#
+# Connecting a circuit only depends on the geometry of its components, so the arrays that Simulation.connect()
+# produces for the same circuit are always the same. The cache stores them in the binary format of binary.py,
+# in a file named after a hash of that geometry, and a Simulation that is given the cache skips connecting
+# when it finds its circuit there. The cache is bounded in size, and the netlists that were not used
+# for the longest time are removed first.
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from simulator import binary
+from simulator.model import Clock
+
+# increase when connect() produces different arrays for the same components, so old entries are never used
+VERSION = 1
+
+
+def default_directory() -> Path:
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "digital-simulator"
+
+
+def geometry_key(components, collapse=False) -> str:
+    """
+    Return a hash of everything connect() looks at: the type, position and hotspots of every component.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"{VERSION} {binary.VERSION} {bool(collapse)}".encode())
+    for component in components:
+        # drawables and models of the same circuit get the same key, whether their coordinates are ints or floats
+        parts = [type(component).__name__, float(component.pos[0]), float(component.pos[1])]
+        for hotspot in component.connectors:
+            parts += [float(hotspot.position[0]), float(hotspot.position[1]), hotspot.radius, hotspot.direction]
+        if isinstance(component, Clock):
+            parts += [component.period, component.phase]
+        h.update(repr(parts).encode())
+    return h.hexdigest()
+
+
+class NetlistCache:
+    """
+    Connected netlists stored in directory (default_directory() by default), found by their geometry_key().
+
+    The cache holds at most max_bytes, the netlists that were used least recently are removed first.
+    """
+
+    def __init__(self, directory=None, max_bytes=256 * 2**20):
+        self.directory = Path(directory) if directory is not None else default_directory()
+        self.max_bytes = max_bytes
+
+    def path(self, key) -> Path:
+        return self.directory / f"{key}{binary.EXT}"
+
+    def get(self, key):
+        """
+        Return the Netlist stored under key, or None if there is none.
+        """
+        path = self.path(key)
+        try:
+            netlist = binary.load_netlist(path)
+        except (OSError, ValueError):
+            # missing, or written by another version of the program
+            return None
+        if netlist is None:
+            return None
+        # the modification time marks the last use
+        os.utime(path)
+        return netlist
+
+    def put(self, key, netlist):
+        """
+        Store a netlist under key and remove the least recently used netlists if the cache is too large.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # write a temporary file first, so other processes never read a partial netlist
+        handle, temporary = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        os.close(handle)
+        try:
+            binary.write(temporary, {f"netlist.{name}": getattr(netlist, name) for name in netlist.fields})
+            os.replace(temporary, self.path(key))
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used netlists until the cache holds at most max_bytes, except the one under keep.
+        """
+        entries = []
+        for path in self.directory.glob(f"*{binary.EXT}"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # removed by another process
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path.stem == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 from abc import abstractmethod, ABCMeta
+from functools import cached_property
 from typing import Tuple, Sequence
 from pathlib import Path
 import json
@@ -9,10 +10,37 @@ import json
 import pygame
 from pygame import Surface, draw, Rect, transform, Vector2, image, time
 
-unknown = Surface((16, 16), pygame.SRCALPHA)
-r = unknown.get_rect()
-draw.line(unknown, "black", r.bottomleft, r.topright)
-draw.line(unknown, "black", r.topleft, r.bottomright)
+from simulator import model
+from simulator.model import Hotspot
+
+# rasterized icons shared by all components, see icon()
+_icons = {}
+
+
+def icon(path, size=None, angle=0) -> Surface:
+    """
+    Return the icon at path (relative to this module), scaled to size and rotated by angle degrees.
+
+    Every combination is loaded and converted only once and then shared by all components,
+    so the returned surface must never be drawn on.
+    """
+    key = (path, None if size is None else tuple(size), angle % 360)
+    surface = _icons.get(key)
+    if surface is None:
+        if key[2]:
+            # always rotate the upright icon, so repeated rotations do not blur or grow it
+            surface = transform.rotate(icon(path, size), key[2])
+        else:
+            surface = image.load(Path(__file__).parent / path)
+            if size is not None:
+                surface = transform.smoothscale(surface, size)
+            surface = surface.convert_alpha()
+        _icons[key] = surface
+    return surface
+
+
+# the four orientations of every kind of component, see ConnectorOverlay.create_connectors()
+_orientations = {}
 
 
 class Drawable:
@@ -22,45 +50,51 @@ class Drawable:
         self.active = False
         self.pos = Vector2(pos)
         self.angle = angle
+        # the number of counterclockwise quarter turns, an index into orientations
+        self.orientation = model.quarter_turns(angle)
         self.listeners = []
         self.state = False
         self.label = label
 
+    def rect(self) -> Rect:
+        """
+        Return the area of the screen this drawable covers.
+        """
+        rect = self.surface.get_rect()
+        rect.center = self.pos
+        return rect
+
     def blit(self, surface):
-        if self.state:
-            rect = self.surface.get_rect()
-            rect.center = self.pos
-            surface.blit(self.surface_on, rect)
-        else:
-            rect = self.surface_on.get_rect()
-            rect.center = self.pos
-            surface.blit(self.surface, rect)
+        rect = self.rect()
+        surface.blit(self.surface_on if self.state else self.surface, rect)
         if self.active:
             draw.rect(surface, "orange", rect, 2)
         if self.selected:
             draw.rect(surface, "red", rect, 1)
 
     def rotate(self, angle):
-        self.surface = transform.rotate(self.surface, angle)
-        self.surface_on = transform.rotate(self.surface_on, angle)
-        self.angle = angle
+        """
+        Rotate counterclockwise by angle degrees, a multiple of 90.
+        """
+        self.angle = (self.angle + angle) % 360
+        self.orient((self.orientation + model.quarter_turns(angle)) % 4)
+
+    def orient(self, orientation):
+        self.orientation = orientation
+        self.surface, self.surface_on = self.orientations[orientation][:2]
 
     def collidepoint(self, pos):
-        rect = self.surface.get_rect()
-        rect.center = self.pos
-        return rect.collidepoint(*pos)
+        return self.rect().collidepoint(*pos)
 
 
-class Hotspot:
-    def __init__(self, position, radius, direction, label=""):
-        self.position = position
-        self.radius = radius
-        self.direction = direction
-        self.state = False
-        self.label = label
+class ConnectorOverlay(Drawable, metaclass=ABCMeta):
+    """
+    A drawable with connectors, drawn on an overlay.
 
+    All components of the same kind share the surfaces, the overlay and the connectors of each of their four
+    orientations, so rotating a component only selects another orientation. None of these may be changed.
+    """
 
-class ConnectorOverlay(Drawable):
     # TODO add hotspot labels
     # TODO make connectors reflect on-state
 
@@ -68,25 +102,53 @@ class ConnectorOverlay(Drawable):
         super().__init__(pos, angle, label)
         self.connectors = []
 
-    def create_overlay(self):
-        r = self.surface.get_rect()
-        self.overlay = Surface(r.size, pygame.SRCALPHA).convert_alpha()
-        return r
-
-    def draw_connectors(self):
-        for hotspot in self.connectors:
+    @property
+    @abstractmethod
+    def kind(self) -> tuple:
+        """
+        A key that is the same for all components that look the same and have the same connectors.
+        """
+
+    @abstractmethod
+    def surfaces(self, quarter) -> Tuple[Surface, Surface]:
+        """
+        Return the off and on surfaces after quarter counterclockwise quarter turns.
+        """
+
+    def create_overlay(self, connectors) -> Surface:
+        overlay = Surface(self.surfaces(0)[0].get_size(), pygame.SRCALPHA).convert_alpha()
+        self.draw_connectors(overlay, connectors)
+        return overlay
+
+    def draw_connectors(self, overlay, connectors):
+        for hotspot in connectors:
             draw.circle(
-                self.overlay,
+                overlay,
                 "black",
-                hotspot.position + self.overlay.get_rect().center,
+                hotspot.position + overlay.get_rect().center,
                 hotspot.radius,
                 2,
             )
 
     def create_connectors(self, connectors):
-        r = self.create_overlay()
-        self.connectors = connectors
-        self.draw_connectors()
+        """
+        Take the orientations of the kind of this component, creating them from the connectors of the upright
+        component if this is the first component of its kind.
+        """
+        key = self.kind
+        self.orientations = _orientations.get(key)
+        if self.orientations is None:
+            overlay = self.create_overlay(connectors)
+            self.orientations = _orientations[key] = tuple(
+                self.surfaces(quarter)
+                + (transform.rotate(overlay, 90 * quarter), model.rotated(connectors, quarter))
+                for quarter in range(4)
+            )
+        self.orient(self.orientation)
+
+    def orient(self, orientation):
+        super().orient(orientation)
+        self.overlay, self.connectors = self.orientations[orientation][2:]
 
     def blit(self, surface):
         super().blit(surface)
@@ -94,12 +156,6 @@ class ConnectorOverlay(Drawable):
         rect.center = self.pos
         surface.blit(self.overlay, rect)
 
-    def rotate(self, angle):
-        super().rotate(angle)
-        self.overlay = transform.rotate(self.overlay, angle)
-        for hotspot in self.connectors:
-            hotspot.position.rotate_ip(-angle)
-
     def collideconnector(self, pos):
         p = Vector2(pos)
         rect = self.surface.get_rect()
@@ -114,17 +170,23 @@ class ConnectorOverlay(Drawable):
 
 class Image(ConnectorOverlay):
     def __init__(self, path, path_on, pos, angle=0, label="unknown", size=None):
-        self.surface = image.load(Path(__file__).parent / path)
-        self.surface_on = image.load(Path(__file__).parent / path_on)
-        if size is not None:
-            self.surface = transform.smoothscale(self.surface, size)
-            self.surface_on = transform.smoothscale(self.surface_on, size)
-        self.surface = self.surface.convert_alpha()
-        self.surface_on = self.surface_on.convert_alpha()
+        self.path = path
+        self.path_on = path_on
+        self.size = size
         super().__init__(pos, angle, label)
+        self.surface = icon(path, size)
+        self.surface_on = icon(path_on, size)
 
+    @property
+    def kind(self) -> tuple:
+        return (type(self).__name__, self.path, self.path_on, None if self.size is None else tuple(self.size))
 
-class Line(ConnectorOverlay):
+    def surfaces(self, quarter) -> Tuple[Surface, Surface]:
+        # the shared rotated icons, see icon()
+        return icon(self.path, self.size, 90 * quarter), icon(self.path_on, self.size, 90 * quarter)
+
+
+class Line(ConnectorOverlay, model.Line):
     def __init__(
         self,
         start,
@@ -143,6 +205,9 @@ class Line(ConnectorOverlay):
         # we need to save this too, if we want to be able to serialize it.
         self.start = start
         self.end = end
+        self.color = color
+        self.color_on = color_on
+        self.linewidth = linewidth
 
         vertical = False
         v = end - start
@@ -156,25 +221,13 @@ class Line(ConnectorOverlay):
         # note that the sizes should be a multiple of 10 ... but 0 is a multiple of 10 too :-)
         size[0] = abs(size[0])
         size[1] = max(10, abs(size[1]))  # this will make it at least 10px high
+        self.size = (int(size[0]), int(size[1]))
 
-        self.surface = Surface(size, pygame.SRCALPHA)
-        self.surface_on = Surface(size, pygame.SRCALPHA)
-        rect = self.surface.get_rect()
-        delta = Vector2(5, 0)
-        draw.line(
-            self.surface, color, rect.midright, rect.midleft, linewidth
-        )
-        draw.line(
-            self.surface_on,
-            color_on,
-            rect.midright,
-            rect.midleft,
-            linewidth,
-        )
-        self.surface = self.surface.convert_alpha()
-        self.surface_on = self.surface_on.convert_alpha()
+        # the orientation follows from start and end, a vertical line is a horizontal one turned a quarter
+        self.angle = 90 if vertical else 0
+        self.orientation = int(vertical)
 
-        r = self.surface.get_rect()
+        r = Rect((0, 0), self.size)
         self.create_connectors(
             [
                 Hotspot(Vector2(0, r.h // 2) - r.center, 6, "bidirectional"),
@@ -183,31 +236,52 @@ class Line(ConnectorOverlay):
             ]
         )
 
-        if vertical:
-            self.rotate(90)
+    @property
+    def kind(self) -> tuple:
+        return ("Line", self.size, self.color, self.color_on, self.linewidth)
+
+    def surfaces(self, quarter) -> Tuple[Surface, Surface]:
+        surface = Surface(self.size, pygame.SRCALPHA)
+        surface_on = Surface(self.size, pygame.SRCALPHA)
+        rect = surface.get_rect()
+        draw.line(surface, self.color, rect.midright, rect.midleft, self.linewidth)
+        draw.line(surface_on, self.color_on, rect.midright, rect.midleft, self.linewidth)
+        return (
+            transform.rotate(surface.convert_alpha(), 90 * quarter),
+            transform.rotate(surface_on.convert_alpha(), 90 * quarter),
+        )
 
-    def draw_connectors(self):
+    def draw_connectors(self, overlay, connectors):
         ...  # do not draw the connectors
 
-class Gate(Image):
-    def __init__(self, path, path_on, pos, angle=0, label="unknown", size=None):
+class Gate(Image, model.Gate):
+    def __init__(self, path, path_on, pos, angle=0, label="unknown", size=None, inputs=2):
+        if size is None:
+            # 20 pixels between the input connectors, which gives the regular 80x60 icon for 2 inputs
+            size = (80, 20 * (inputs + 1))
         super().__init__(path, path_on, pos, angle, label, size)
 
+        self.inputs = inputs
+
         r = self.surface.get_rect()
 
         self.create_connectors(
             [Hotspot(Vector2(r.w, r.h // 2) - r.center, 6, "output")]
             + [
-                Hotspot(Vector2(hotspot) - r.center, 6, "input")
-                for hotspot in ((0, r.h // 3), (0, 2 * r.h // 3))
+                Hotspot(Vector2(0, (i + 1) * r.h // (inputs + 1)) - r.center, 6, "input")
+                for i in range(inputs)
             ]
         )
 
-    def draw_connectors(self):
+    @property
+    def kind(self) -> tuple:
+        return super().kind + (self.inputs,)
+
+    def draw_connectors(self, overlay, connectors):
         ...
 
 
-class Input(Image):
+class Input(Image, model.Input):
     def __init__(self, pos, angle=0, label="input", size=None):
         super().__init__(
             "icons/80x60/INPUT_OFF.svg", "icons/80x60/INPUT_ON.svg", pos, angle, label, size
@@ -231,7 +305,37 @@ class Input(Image):
         self.state = not self.state
 
 
-class Output(Image):
+class Clock(Image, model.Clock):
+    """
+    An input that is driven by the simulation time instead of by the user, see Simulation.run().
+
+    A clock is low for the first half of its period (in cycles) and high for the second half,
+    phase shifts this pattern by that many cycles.
+    """
+
+    def __init__(self, pos, angle=0, label="clock", size=None, period=2, phase=0):
+        model.Clock.check(period, phase)
+        super().__init__(
+            "icons/80x60/CLOCK_OFF.svg", "icons/80x60/CLOCK_ON.svg", pos, angle, label, size
+        )
+
+        r = self.surface.get_rect()
+
+        self.create_connectors(
+            [
+                Hotspot(
+                    Vector2(r.w, r.h // 2) - r.center,
+                    6,
+                    "output",
+                )
+            ]
+        )
+
+        self.period = period
+        self.phase = phase
+
+
+class Output(Image, model.Output):
     def __init__(self, pos, angle=0, label="output", size=None):
         super().__init__(
             "icons/80x60/OUTPUT_OFF.svg", "icons/80x60/OUTPUT_ON.svg", pos, angle, label, size
@@ -243,8 +347,8 @@ class Output(Image):
             [Hotspot(Vector2(0, r.h // 2) - r.center, 6, "input")])
 
 
-class AndGate(Gate):
-    def __init__(self, pos, angle=0, label="and", size=None):
+class AndGate(Gate, model.AndGate):
+    def __init__(self, pos, angle=0, label="and", size=None, inputs=2):
         super().__init__(
             "icons/80x60/AND_OFF.svg",
             "icons/80x60/AND_ON.svg",
@@ -252,11 +356,12 @@ class AndGate(Gate):
             angle,
             label,
             size,
+            inputs,
         )
 
 
-class NandGate(Gate):
-    def __init__(self, pos, angle=0, label="nand", size=None):
+class NandGate(Gate, model.NandGate):
+    def __init__(self, pos, angle=0, label="nand", size=None, inputs=2):
         super().__init__(
             "icons/80x60/NAND_OFF.svg",
             "icons/80x60/NAND_ON.svg",
@@ -264,43 +369,83 @@ class NandGate(Gate):
             angle,
             label,
             size,
+            inputs,
+        )
+
+
+class OrGate(Gate, model.OrGate):
+    def __init__(self, pos, angle=0, label="or", size=None, inputs=2):
+        super().__init__(
+            "icons/OR_ANSI_Labelled.svg",
+            "icons/OR_ANSI_Labelled_ON.svg",
+            pos,
+            angle,
+            label,
+            size,
+            inputs,
+        )
+
+
+class NorGate(Gate, model.NorGate):
+    def __init__(self, pos, angle=0, label="nor", size=None, inputs=2):
+        super().__init__(
+            "icons/NOR_ANSI_Labelled.svg",
+            "icons/NOR_ANSI_Labelled_ON.svg",
+            pos,
+            angle,
+            label,
+            size,
+            inputs,
+        )
+
+
+class XorGate(Gate, model.XorGate):
+    def __init__(self, pos, angle=0, label="xor", size=None, inputs=2):
+        super().__init__(
+            "icons/XOR_ANSI_Labelled.svg",
+            "icons/XOR_ANSI_Labelled_ON.svg",
+            pos,
+            angle,
+            label,
+            size,
+            inputs,
         )
 
 
 class ComponentEncoder(json.JSONEncoder):
     def default(self, obj):
         # Convert custom classes to dictionaries
-        if isinstance(obj, Line):
-            return {
-                "type": obj.__class__.__name__,
-                "dict": {
-                    "start": obj.start,
-                    "end": obj.end,
-                    "angle": obj.angle,
-                    "label": obj.label,
-                },
-            }
-        elif isinstance(obj, Drawable):
-            return {
-                "type": obj.__class__.__name__,
-                "dict": {"pos": obj.pos, "angle": obj.angle, "label": obj.label},
-            }
-        elif isinstance(obj, Vector2):
+        if isinstance(obj, model.Component):
+            return {"type": obj.__class__.__name__, "dict": obj.parameters()}
+        elif isinstance(obj, (Vector2, model.Vector)):
             return (obj.x, obj.y)
         return super().default(obj)
 
 
+def drawable(component):
+    """
+    Return a drawable for a component from model.py. Drawables are returned as they are.
+    """
+    if isinstance(component, Drawable):
+        return component
+    return globals()[type(component).__name__](**component.parameters())
+
+
 class ComponentDecoder:
+    """
+    Decode a .dsim file into the lightweight components of model.py.
+
+    The drawable versions (d_objs and l_objs) are only created, and their icons loaded, when they are first used.
+    """
+
     def __init__(self, obj):
-        drawables = obj["drawables"]
-        library = obj["library"]
-        self.d_objs = []
-        self.l_objs = []
-        for d in drawables:
-            t = globals()[d["type"]]
-            d_obj = t(**d["dict"])
-            self.d_objs.append(d_obj)
-        for l in library:
-            t = globals()[l["type"]]
-            l_obj = t(**l["dict"])
-            self.l_objs.append(l_obj)
+        self.models = [model.build(d) for d in obj["drawables"]]
+        self.library_models = [model.build(l) for l in obj["library"]]
+
+    @cached_property
+    def d_objs(self):
+        return [drawable(m) for m in self.models]
+
+    @cached_property
+    def l_objs(self):
+        return [drawable(m) for m in self.library_models]
@@ -0,0 +1,117 @@
+# Copyright 2024 - 2024, Michel Anders and the Digital Simulator contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# The hotspots of a circuit that overlap, kept up to date while the circuit is edited.
+#
+# Finding the overlapping hotspots is the expensive, geometric part of Simulation.connect().
+# An editor keeps a Connections object next to its list of components and tells it about every component
+# that moves or rotates, which only looks at the hotspots near that component. Connecting a Simulation
+# with these connections then only has to follow the pairs that are already known.
+# A Simulation without an editor builds a Connections object of its own, so there is a single way to find them.
+
+from math import floor, hypot
+
+from simulator.spatial import AppendOnlyIndex
+
+# the directions of the hotspots a hotspot can be connected to: two inputs or two outputs never are
+PARTNERS = {
+    "input": ("output", "bidirectional"),
+    "output": ("input", "bidirectional"),
+    "bidirectional": ("input", "output", "bidirectional"),
+}
+
+
+def overlap(position, radius, other_position, other_radius) -> bool:
+    """
+    Check if two hotspots overlap, i.e. their centers are at most the sum of their radii apart.
+    """
+    return hypot(position[0] - other_position[0], position[1] - other_position[1]) <= radius + other_radius
+
+
+class Connections(AppendOnlyIndex):
+    """
+    The pairs of overlapping hotspots of different components in a list of components.
+
+    A hotspot is identified by (component, connector index), and only hotspots that can be connected are paired.
+    Components that move or rotate must be passed to update().
+    The hotspots are kept in a uniform grid with cells of cellsize, by default four times the largest radius of a hotspot,
+    so the hotspots that overlap a hotspot are always in the 2 by 2 cells nearest to it.
+    """
+
+    def __init__(self, components, cellsize=None):
+        self.default_cellsize = cellsize
+        super().__init__(components)
+
+    def clear(self):
+        # cell -> the hotspots in it as (component, connector index, x, y, radius, direction),
+        # component -> the cells of its hotspots
+        self.grid = {}
+        self.cells = {}
+        # hotspot -> the overlapping hotspots of other components, for the hotspots that overlap any
+        self.neighbours = {}
+        # the largest radius of any hotspot, which determines how far around a hotspot is searched
+        self.radius = max(
+            (connector.radius for component in self.items for connector in component.connectors), default=0
+        )
+        self.cellsize = self.default_cellsize
+        if self.cellsize is None and self.radius:
+            self.cellsize = 4 * self.radius
+
+    def append(self, index, component):
+        if component not in self.cells:
+            self.add(component)
+
+    def add(self, component):
+        grid = self.grid
+        neighbours = self.neighbours
+        x, y = component.pos
+        cells = []
+        for connector_index, connector in enumerate(component.connectors):
+            radius = connector.radius
+            self.radius = max(self.radius, radius)
+            if self.cellsize is None:
+                # the list was empty when the grid was set up
+                self.cellsize = max(4 * self.radius, 1)
+            cellsize = self.cellsize
+            dx, dy = connector.position
+            px, py = x + dx, y + dy
+            partners = PARTNERS.get(connector.direction, tuple(PARTNERS))
+            # the cells that a hotspot this one overlaps may be in, at most 2 by 2 with the default cell size
+            reach = radius + self.radius
+            rows = range(floor((py - reach) / cellsize), floor((py + reach) / cellsize) + 1)
+            for i in range(floor((px - reach) / cellsize), floor((px + reach) / cellsize) + 1):
+                for j in rows:
+                    for other_component, other_index, ox, oy, other_radius, direction in grid.get((i, j), ()):
+                        # no connections to self are allowed
+                        if (
+                            direction in partners
+                            and other_component is not component
+                            and overlap((px, py), radius, (ox, oy), other_radius)
+                        ):
+                            hotspot, other = (component, connector_index), (other_component, other_index)
+                            neighbours.setdefault(hotspot, set()).add(other)
+                            neighbours.setdefault(other, set()).add(hotspot)
+            cell = (floor(px / cellsize), floor(py / cellsize))
+            grid.setdefault(cell, []).append((component, connector_index, px, py, radius, connector.direction))
+            cells.append(cell)
+        self.cells[component] = cells
+
+    def remove(self, component):
+        for connector_index, cell in enumerate(self.cells.pop(component, ())):
+            hotspot = (component, connector_index)
+            self.grid[cell] = [entry for entry in self.grid[cell] if entry[:2] != hotspot]
+            for other in self.neighbours.pop(hotspot, ()):
+                self.neighbours[other].discard(hotspot)
+
+    def update(self, component):
+        """
+        Find the hotspots that overlap those of a component again, after it moved or rotated.
+        """
+        self.remove(component)
+        self.add(component)
+
+    def overlapping(self, component, connector_index) -> set:
+        """
+        Return the hotspots of other components that overlap the given hotspot.
+        """
+        return self.neighbours.get((component, connector_index), set())
@@ -6,7 +6,7 @@ from pathlib import Path
 import pygame
 import pygame_gui
 from pygame_gui.windows import ui_file_dialog
-from pygame import image, time, draw, Vector2, locals, font, Rect
+from pygame import image, time, draw, Vector2, locals, font, Rect, Surface
 import pygame_gui.windows.ui_message_window
 
 # note: we need all inputs here because we are going to create components dynamically based on their name
@@ -17,11 +17,17 @@ from simulator.component import (
     Gate,
     ComponentEncoder,
     Input,
+    Clock,
     Output,
     AndGate,
     NandGate,
+    OrGate,
+    NorGate,
+    XorGate,
 )
 from simulator.simulation import Simulation
+from simulator.spatial import SpatialIndex
+from simulator.connections import Connections
 
 EXT = ".dsim"
 
@@ -53,6 +59,10 @@ class Display:
 
         self.drawables = []
         self.library = []
+        self._index = None
+        self._connections = None
+        # the drawable that was being dragged when the editor started the simulation
+        self.dragged = None
 
         self.font = font.Font(None, 16)
 
@@ -251,12 +261,39 @@ class Display:
         self.filename = self.new_filename
         self.changed = False
 
+    @property
+    def index(self) -> SpatialIndex:
+        """
+        The spatial index of the drawables, which is rebuilt when another list of drawables is loaded.
+        """
+        if self._index is None or self._index.items is not self.drawables:
+            self._index = SpatialIndex(self.drawables)
+        return self._index
+
+    @property
+    def connections(self) -> Connections:
+        """
+        The overlapping hotspots of the drawables, kept up to date while editing so that simulation starts quickly.
+        """
+        if self._connections is None or self._connections.items is not self.drawables:
+            self._connections = Connections(self.drawables)
+        return self._connections
+
     def flip(self):
         self.time_delta = self.clock.tick(self.FPS) / 1000.0
         self.manager.update(self.time_delta)
         self.manager.draw_ui(self.screen)
         pygame.display.flip()
 
+    def update(self, rects):
+        """
+        Like flip(), but only send the given rects of the screen to the display.
+        """
+        self.time_delta = self.clock.tick(self.FPS) / 1000.0
+        self.manager.update(self.time_delta)
+        self.manager.draw_ui(self.screen)
+        pygame.display.update(rects)
+
     @staticmethod
     def quit():
         pygame.quit()
@@ -278,6 +315,47 @@ class Display:
             d.blit(self.screen)
         self.status()
 
+    def create_background(self) -> Surface:
+        """
+        Return a picture of all drawables in their off state, with their connectors.
+
+        While simulating nothing moves, so only the drawables that are on have to be drawn on top of it.
+        """
+        background = Surface(self.screen.get_size()).convert()
+        background.fill("white")
+        for d in self.drawables:
+            state, d.state = d.state, False
+            d.blit(background)
+            d.state = state
+        return background
+
+    def redraw_simulation(self, background):
+        self.screen.blit(background, (0, 0))
+        for d in self.drawables:
+            if d.state:
+                d.blit(self.screen)
+        self.status()
+
+    def redraw_changed(self, changed, rects, background) -> list:
+        """
+        Repaint only the area of the drawables that changed and return the rects that were repainted.
+
+        The area is restored from the background (see create_background()) and the drawables that are on are drawn
+        on top. rects holds the rects of all drawables, so the drawables that overlap a changed one are found quickly.
+        """
+        dirty = []
+        for d in changed:
+            rect = d.rect()
+            self.screen.set_clip(rect)
+            self.screen.blit(background, rect, rect)
+            for index in rect.collidelistall(rects):
+                if self.drawables[index].state:
+                    self.drawables[index].blit(self.screen)
+            self.status()
+            dirty.append(rect)
+        self.screen.set_clip(None)
+        return dirty
+
     def redraw_library(self):
         r = self.screen.get_rect()
         y = r.h - 80
@@ -335,18 +413,19 @@ class Display:
                             Line(line_start, line_end,
                                  color="blue", linewidth=3)
                         )
+                        self.connections.sync()
                         print(line_start, line_end)
                         line_start = line_end
                         self.changed = True
                         continue
                     else:
-                        for i, r in enumerate(self.drawables):
+                        for r in self.index.at(event.pos):
                             click, connector_position = r.collideconnector(
                                 event.pos)
                             if click:
                                 print(
                                     f"click on object {
-                                        i} output at {event.pos}"
+                                        r.label} output at {event.pos}"
                                 )
                                 drawing = True
                                 line_start = Vector2(connector_position)
@@ -390,6 +469,7 @@ class Display:
                 elif event.type == pygame.MOUSEBUTTONUP:
                     if dragging:
                         # Stop dragging when the mouse button is released
+                        self.connections.update(dragged_rect_index)
                         dragging = False
                         dragged_rect_index = None
                         self.changed = True
@@ -400,6 +480,7 @@ class Display:
                     # Update the position of the drawable while dragging
                     if dragging and dragged_rect_index is not None:
                         dragged_rect_index.pos = event.pos + offset
+                        self.index.move(dragged_rect_index)
                         self.changed = True
                     elif drawing:
                         line_end = Vector2(event.pos)
@@ -407,8 +488,12 @@ class Display:
                     print(event)
                     if event.key == locals.K_r and active_object is not None:
                         active_object.rotate(90)
+                        self.index.move(active_object)
+                        self.connections.update(active_object)
                         self.changed = True
                     elif event.key == locals.K_s:
+                        # a dragged drawable has not been dropped yet, simulate() updates its connections
+                        self.dragged = dragged_rect_index if dragging else None
                         running = False
                         reason = "Start simulation"
                         self.mode = reason
@@ -428,9 +513,20 @@ class Display:
                         t = type(copy_drawable)
                         pos = pygame.mouse.get_pos()
                         print(t)
-                        d = t(pos)
+                        if isinstance(copy_drawable, Gate):
+                            d = t(pos, copy_drawable.angle, inputs=copy_drawable.inputs)
+                        elif isinstance(copy_drawable, Clock):
+                            d = t(
+                                pos,
+                                copy_drawable.angle,
+                                period=copy_drawable.period,
+                                phase=copy_drawable.phase,
+                            )
+                        else:
+                            d = t(pos, copy_drawable.angle)
                         print(d)
                         self.drawables.append(d)
+                        self.connections.sync()
                         self.changed = True
                 self.process_menu_events(event)
                 self.manager.process_events(event)
@@ -461,26 +557,66 @@ class Display:
         self.flip()
         return reason
 
+    def settle(self, simulation):
+        """
+        Settle the simulation, reporting an oscillating circuit instead of running forever.
+        """
+        n = simulation.settle()
+        if not simulation.settled:
+            oscillation = simulation.find_oscillation()
+            if oscillation is not None:
+                period, elements = oscillation
+                elements = set(elements.tolist())
+                labels = [
+                    d.label
+                    for d, element in zip(self.drawables, simulation.slot.tolist())
+                    if element in elements
+                ]
+                print(f"circuit oscillates with a period of {period} steps: {labels}")
+        return n
+
     def simulate(self):
         self.mode = "Simulate"
         self.reset()
 
-        simulation = Simulation(self.drawables)
+        # the editor only passes on a drag when the drawable is dropped, which it was not if the simulation started first
+        self.connections.sync()
+        if self.dragged is not None:
+            self.connections.update(self.dragged)
+            self.dragged = None
+        simulation = Simulation(
+            self.drawables, engine="event", collapse=True, connections=self.connections
+        )
         simulation.connect()
         simulation.update_inputs()
 
         simulation._dump()
         
-        n = 1
-        while simulation.simulate_np():
-            n += 1
+        if simulation.cycles:
+            print(f"{len(simulation.cycles)} feedback loops in the circuit")
+
+        n = self.settle(simulation)
         print(f"{n} steps of simulation at the start")
         simulation.update_components()
 
+        # nothing moves while simulating, so after a full redraw only the drawables that change need repainting
+        background = self.create_background()
+        self.redraw_simulation(background)
+        self.flip()
+        rects = [d.rect() for d in self.drawables]
+
+        # c starts and stops the clocks, that then advance this many cycles every frame (+ and - double or halve it)
+        clocks_running = False
+        cycles_per_frame = 1
+
         running = True
         reason = None
         while running:
             yield
+            changed = []
+            if clocks_running:
+                simulation.run(cycles_per_frame)
+                changed += simulation.update_components()
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     running = False
@@ -488,16 +624,14 @@ class Display:
                     self.mode = reason
                     return
                 elif event.type == pygame.MOUSEBUTTONUP:
-                    for i, r in enumerate(self.drawables):
+                    for r in self.index.at(event.pos):
                         if r.collidepoint(event.pos):
                             if hasattr(r, "toggle"):
                                 r.toggle()
                                 simulation.update_inputs()
-                                n = 1
-                                while simulation.simulate_np():
-                                    n += 1
+                                n = self.settle(simulation)
                                 print(f"{n} steps of simulation after click")
-                                simulation.update_components()
+                                changed += simulation.update_components()
 
                 elif event.type == pygame.KEYUP:
                     print(event)
@@ -506,8 +640,13 @@ class Display:
                         reason = "Stop simulation"
                         self.mode = reason
                         return
-            self.redraw()
-            self.flip()
+                    elif event.key == locals.K_c:
+                        clocks_running = not clocks_running
+                    elif event.key in (locals.K_PLUS, locals.K_EQUALS, locals.K_KP_PLUS):
+                        cycles_per_frame *= 2
+                    elif event.key in (locals.K_MINUS, locals.K_KP_MINUS):
+                        cycles_per_frame = max(1, cycles_per_frame // 2)
+            self.update(self.redraw_changed(changed, rects, background))
 
         self.screen.fill("white")
         self.flip()
@@ -0,0 +1,175 @@
+# Copyright 2024 - 2024, Michel Anders and the Digital Simulator contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Stuck-at fault simulation.
+#
+# A stuck-at fault forces the output of a single element to 0 or 1, whatever its inputs are.
+# A fault is detected by a test pattern if at least one Output differs from the fault-free circuit.
+# Faults are simulated 64 at a time with Simulation.settle_packed(): every bit lane carries a different fault,
+# implemented by overriding the lookup masks of the faulty element in that lane only,
+# and all lanes get the same input pattern. Groups of 64 faults are spread over a pool of processes.
+# A single fault can also be simulated with the normal engines by setting the operation of the element
+# to one of the constant functions STUCK_AT[value].
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
+from simulator.simulation import Simulation, ALL_LANES
+
+# the operations of the lookup table that ignore the inputs and always return 0 or 1
+STUCK_AT = (24, 28)
+
+# the simulation used by the processes in the pool, see _initialize()
+_simulation = None
+
+
+def fault_sites(simulation) -> np.ndarray:
+    """
+    Return the elements that get a stuck-at fault by default: every element except the Inputs and the dummy element.
+    """
+    sites = np.ones(simulation.n, dtype=bool)
+    sites[simulation.input_index] = False
+    sites[simulation.n - 1] = False
+    return np.flatnonzero(sites).astype(np.int32)
+
+
+def all_faults(simulation) -> np.ndarray:
+    """
+    Return a (m, 2) array with a stuck-at-0 and a stuck-at-1 fault (element, value) for every fault site.
+    """
+    sites = fault_sites(simulation)
+    return np.stack(
+        (np.repeat(sites, 2), np.tile(np.array([0, 1], dtype=np.int32), len(sites))), axis=1
+    )
+
+
+def _detect(simulation, patterns, good, faults, max_steps):
+    """
+    Simulate up to 64 faults, one per bit lane, and return for every fault the index of the first pattern
+    that detects it, or -1 if none of the patterns does.
+    """
+    lanes = np.uint64(1) << np.arange(len(faults), dtype=np.uint64)
+    zero = np.zeros(simulation.n, dtype=np.uint64)
+    one = np.zeros(simulation.n, dtype=np.uint64)
+    stuck = faults[:, 1] == 1
+    np.bitwise_or.at(zero, faults[~stuck, 0], lanes[~stuck])
+    np.bitwise_or.at(one, faults[stuck, 0], lanes[stuck])
+
+    first = np.full(len(faults), -1, dtype=np.int64)
+    undetected = np.bitwise_or.reduce(lanes)
+    for index, (pattern, expected) in enumerate(zip(patterns, good)):
+        words = np.where(pattern, ALL_LANES, np.uint64(0))
+        output = simulation.settle_packed(words, max_steps, (zero, one))[simulation.output_index]
+        differs = np.bitwise_or.reduce(output ^ np.where(expected, ALL_LANES, np.uint64(0)))
+        detected = differs & undetected
+        if detected:
+            first[(detected & lanes) != 0] = index
+            undetected &= ~detected
+            if not undetected:
+                break
+    return first
+
+
+def _initialize(netlist):
+    global _simulation
+    # _detect() only uses run_batch() and settle_packed(), which are plain numpy, so a worker never needs to compile
+    _simulation = Simulation.from_netlist(netlist, backend="numpy")
+
+
+def _detect_in_pool(patterns, good, faults, max_steps):
+    return _detect(_simulation, patterns, good, faults, max_steps)
+
+
+class FaultReport:
+    """
+    The result of a fault simulation campaign.
+
+    faults is a (m, 2) array of (element, stuck-at value) pairs and first_pattern holds, for every fault,
+    the index of the first pattern that detects it or -1. names maps elements to readable names.
+    """
+
+    def __init__(self, faults, first_pattern, patterns, names=None):
+        self.faults = faults
+        self.first_pattern = first_pattern
+        self.patterns = patterns
+        self.names = names or {}
+
+    @property
+    def detected(self) -> np.ndarray:
+        return self.first_pattern >= 0
+
+    @property
+    def coverage(self) -> float:
+        """
+        The fraction of the faults that is detected by at least one pattern.
+        """
+        if not len(self.faults):
+            return 1.0
+        return float(self.detected.mean())
+
+    def undetected(self) -> list:
+        """
+        Return the (element, value) pairs of the faults that no pattern detects.
+        """
+        return [tuple(fault) for fault in self.faults[~self.detected].tolist()]
+
+    def __str__(self):
+        lines = [
+            f"{int(self.detected.sum())} of {len(self.faults)} stuck-at faults detected"
+            f" by {len(self.patterns)} patterns, coverage {self.coverage:.1%}"
+        ]
+        for element, value in self.undetected():
+            lines.append(f"  undetected: {self.names.get(element, f'element {element}')} stuck-at-{value}")
+        return "\n".join(lines)
+
+
+def simulate_faults(
+    simulation, patterns=None, faults=None, workers=None, max_steps=None, seed=0
+) -> FaultReport:
+    """
+    Determine which stuck-at faults are detected by a set of test patterns.
+
+    simulation must be connected. patterns is a (k, number of inputs) boolean array in the order of input_index;
+    by default all combinations if there are at most 12 inputs, otherwise 1024 random patterns.
+    faults is a (m, 2) array of (element, value) pairs, by default all_faults(simulation).
+    The faults are simulated in groups of 64, spread over workers processes (all cores by default).
+    With workers=1 everything runs in the current process.
+    """
+    inputs = len(simulation.input_index)
+    if patterns is None:
+        if inputs <= 12:
+            patterns = (np.arange(2**inputs)[:, np.newaxis] >> np.arange(inputs)) & 1
+        else:
+            patterns = np.random.default_rng(seed).integers(0, 2, (1024, inputs))
+    patterns = np.asarray(patterns, dtype=bool).reshape(-1, inputs)
+    if faults is None:
+        faults = all_faults(simulation)
+    faults = np.asarray(faults, dtype=np.int32).reshape(-1, 2)
+    if max_steps is None:
+        max_steps = simulation.n + 1
+
+    good = simulation.run_batch(patterns, max_steps)
+    groups = [faults[start : start + 64] for start in range(0, len(faults), 64)]
+    workers = min(workers or os.cpu_count() or 1, len(groups))
+    if workers <= 1:
+        results = [_detect(simulation, patterns, good, group, max_steps) for group in groups]
+    else:
+        with ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_initialize,
+            initargs=(simulation.netlist(),),
+        ) as pool:
+            results = list(
+                pool.map(_detect_in_pool, repeat(patterns), repeat(good), groups, repeat(max_steps))
+            )
+    first_pattern = np.concatenate(results) if results else np.zeros(0, dtype=np.int64)
+
+    names = {}
+    for component, element in zip(simulation.components, simulation.slot.tolist()):
+        names.setdefault(element, f"{type(component).__name__} {component.label!r}")
+    return FaultReport(faults, first_pattern, patterns, names)
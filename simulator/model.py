@@ -0,0 +1,289 @@
+# Copyright 2024 - 2024, Michel Anders and the Digital Simulator contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# The components of a circuit without anything to draw them: a position, a label, the parameters
+# that are saved in a .dsim file and the hotspots that are needed to connect them.
+#
+# This module does not use pygame, so circuits can be loaded and simulated on machines without a display.
+# The drawable components in component.py derive from these classes, so a Simulation treats both the same.
+# The geometry must stay identical to that of the drawables, which is checked in test_drawables.py.
+
+import json
+from functools import lru_cache
+from math import floor, hypot
+
+
+class Vector:
+    """
+    A minimal 2D vector, with just the operations the simulation needs (pygame's Vector2 has the same interface).
+    """
+
+    __slots__ = ("x", "y")
+
+    def __init__(self, x, y=None):
+        if y is None:
+            x, y = x
+        self.x = x
+        self.y = y
+
+    def __add__(self, other):
+        return Vector(self.x + other[0], self.y + other[1])
+
+    def __sub__(self, other):
+        return Vector(self.x - other[0], self.y - other[1])
+
+    def __floordiv__(self, value):
+        return Vector(floor(self.x / value), floor(self.y / value))
+
+    def __getitem__(self, index):
+        return (self.x, self.y)[index]
+
+    def __len__(self):
+        return 2
+
+    def __iter__(self):
+        return iter((self.x, self.y))
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return f"Vector({self.x}, {self.y})"
+
+    def length(self) -> float:
+        return hypot(self.x, self.y)
+
+
+class Hotspot:
+    __slots__ = ("position", "radius", "direction", "state", "label")
+
+    def __init__(self, position, radius, direction, label=""):
+        self.position = position
+        self.radius = radius
+        self.direction = direction
+        self.state = False
+        self.label = label
+
+
+def _centered(x, y, size):
+    # a point on a rectangle of the given size, relative to the center of that rectangle
+    w, h = size
+    return Vector(x - w // 2, y - h // 2)
+
+
+def quarter_turns(angle) -> int:
+    """
+    Return the number of counterclockwise quarter turns, 0 to 3, of a component rotated by angle degrees.
+    """
+    return int(angle) // 90 % 4
+
+
+def rotated(connectors, quarter) -> tuple:
+    """
+    Return copies of the connectors turned counterclockwise by quarter * 90 degrees around the center,
+    like pygame's Vector2.rotate(-90 * quarter).
+    """
+    for _ in range(quarter):
+        connectors = tuple(
+            Hotspot(type(h.position)(h.position.y, -h.position.x), h.radius, h.direction, h.label)
+            for h in connectors
+        )
+    return tuple(connectors)
+
+
+@lru_cache
+def _gate_connectors(size, inputs, quarter=0):
+    w, h = size
+    return rotated(
+        (Hotspot(_centered(w, h // 2, size), 6, "output"),)
+        + tuple(Hotspot(_centered(0, (i + 1) * h // (inputs + 1), size), 6, "input") for i in range(inputs)),
+        quarter,
+    )
+
+
+@lru_cache
+def _source_connectors(size, quarter=0):
+    # a single output on the right, for inputs and clocks
+    return rotated((Hotspot(_centered(size[0], size[1] // 2, size), 6, "output"),), quarter)
+
+
+@lru_cache
+def _sink_connectors(size, quarter=0):
+    # a single input on the left, for outputs
+    return rotated((Hotspot(_centered(0, size[1] // 2, size), 6, "input"),), quarter)
+
+
+class Component:
+    """
+    A component with its position, label and connectors.
+
+    angle is the rotation in degrees, counterclockwise in multiples of 90.
+    Components of the same type, size and orientation share a single tuple of connectors, which must not be changed.
+    The drawables in component.py share theirs in the same way, see ConnectorOverlay.
+    """
+
+    __slots__ = ("pos", "angle", "label", "state", "connectors", "listeners", "inputmap", "connected")
+
+    def __init__(self, pos, angle=0, label="unknown"):
+        self.pos = Vector(pos)
+        self.angle = angle
+        self.label = label
+        self.state = False
+        self.listeners = []
+        self.connectors = ()
+
+    def parameters(self) -> dict:
+        """
+        Return the arguments that recreate this component, as saved in a .dsim file.
+        """
+        return {"pos": tuple(self.pos), "angle": self.angle, "label": self.label}
+
+
+class Gate(Component):
+    __slots__ = ("inputs",)
+
+    def __init__(self, pos, angle=0, label="unknown", size=None, inputs=2):
+        super().__init__(pos, angle, label)
+        if size is None:
+            size = (80, 20 * (inputs + 1))
+        self.inputs = inputs
+        self.connectors = _gate_connectors((int(size[0]), int(size[1])), inputs, quarter_turns(angle))
+
+    def parameters(self) -> dict:
+        parameters = super().parameters()
+        if self.inputs != 2:
+            parameters["inputs"] = self.inputs
+        return parameters
+
+
+class AndGate(Gate):
+    __slots__ = ()
+
+    def __init__(self, pos, angle=0, label="and", size=None, inputs=2):
+        super().__init__(pos, angle, label, size, inputs)
+
+
+class NandGate(Gate):
+    __slots__ = ()
+
+    def __init__(self, pos, angle=0, label="nand", size=None, inputs=2):
+        super().__init__(pos, angle, label, size, inputs)
+
+
+class OrGate(Gate):
+    __slots__ = ()
+
+    def __init__(self, pos, angle=0, label="or", size=None, inputs=2):
+        super().__init__(pos, angle, label, size, inputs)
+
+
+class NorGate(Gate):
+    __slots__ = ()
+
+    def __init__(self, pos, angle=0, label="nor", size=None, inputs=2):
+        super().__init__(pos, angle, label, size, inputs)
+
+
+class XorGate(Gate):
+    __slots__ = ()
+
+    def __init__(self, pos, angle=0, label="xor", size=None, inputs=2):
+        super().__init__(pos, angle, label, size, inputs)
+
+
+# the size of the icons of inputs, clocks and outputs
+ICON_SIZE = (40, 40)
+
+
+class Input(Component):
+    __slots__ = ()
+
+    def __init__(self, pos, angle=0, label="input", size=None):
+        super().__init__(pos, angle, label)
+        self.connectors = _source_connectors(
+            ICON_SIZE if size is None else tuple(size), quarter_turns(angle)
+        )
+
+    def toggle(self):
+        self.state = not self.state
+
+
+class Clock(Component):
+    __slots__ = ("period", "phase")
+
+    def __init__(self, pos, angle=0, label="clock", size=None, period=2, phase=0):
+        self.check(period, phase)
+        super().__init__(pos, angle, label)
+        self.connectors = _source_connectors(
+            ICON_SIZE if size is None else tuple(size), quarter_turns(angle)
+        )
+        self.period = period
+        self.phase = phase
+
+    @staticmethod
+    def check(period, phase):
+        """
+        Raise a ValueError unless a clock with this period and phase can be simulated.
+
+        The period must be at least 2 cycles, to have a low and a high half, and the phase may not be negative.
+        """
+        if period < 2:
+            raise ValueError(f"the period of a clock must be at least 2 cycles, not {period}")
+        if phase < 0:
+            raise ValueError(f"the phase of a clock may not be negative, not {phase}")
+
+    def parameters(self) -> dict:
+        return super().parameters() | {"period": self.period, "phase": self.phase}
+
+
+class Output(Component):
+    __slots__ = ()
+
+    def __init__(self, pos, angle=0, label="output", size=None):
+        super().__init__(pos, angle, label)
+        self.connectors = _sink_connectors(
+            ICON_SIZE if size is None else tuple(size), quarter_turns(angle)
+        )
+
+
+class Line(Component):
+    __slots__ = ("start", "end")
+
+    def __init__(self, start, end, angle=0, label="", **style):
+        start = Vector(start)
+        end = Vector(end)
+        super().__init__((end + start) // 2, angle, label)
+        self.start = start
+        self.end = end
+
+        # the same geometry as a drawn Line: a horizontal rectangle at least 10 high, rotated if the line is vertical.
+        # The orientation follows from start and end, the angle is only saved.
+        v = end - start
+        vertical = abs(v.y) > abs(v.x)
+        if vertical:
+            v = Vector(v.y, v.x)
+        size = (int(abs(v.x)), int(max(10, abs(v.y))))
+        ends = [_centered(0, size[1] // 2, size), _centered(size[0], size[1] // 2, size)]
+        self.connectors = rotated((Hotspot(p, 6, "bidirectional") for p in ends), int(vertical))
+
+    def parameters(self) -> dict:
+        return {"start": tuple(self.start), "end": tuple(self.end), "angle": self.angle, "label": self.label}
+
+
+def build(d):
+    """
+    Return the component described by an entry of a .dsim file, i.e. a dict with a type and its parameters.
+    """
+    return globals()[d["type"]](**d["dict"])
+
+
+def load(obj) -> list:
+    """
+    Return the components of a decoded .dsim file, see ComponentDecoder for the drawable version.
+    """
+    return [build(d) for d in obj["drawables"]]
+
+
+def load_file(path) -> list:
+    with open(path) as f:
+        return load(json.load(f))
@@ -0,0 +1,245 @@
+# Copyright 2024 - 2024, Michel Anders and the Digital Simulator contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Simulate a single very large netlist with several worker processes.
+#
+# The elements are divided into shards and every worker evaluates the elements of one shard.
+# All state lives in a single block of shared memory: the two inputs of every element and a double buffered output.
+# A worker writes only the inputs and outputs of its own elements, but reads the outputs of any element it depends on,
+# so signals that cross a shard boundary are exchanged through shared memory without copying whole arrays around.
+# The only messages over the pipes are the commands for each step and a flag that tells if the shard changed.
+
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from simulator.simulation import csr_ranges, gather_wide
+
+
+def regions(netlist) -> np.ndarray:
+    """
+    Label every element with the smallest index of the connected region it belongs to.
+
+    Two elements are in the same region if one reads the output of the other, directly or indirectly.
+    Reading from the dummy element (the always False last element) does not connect anything.
+    """
+    n = netlist.n
+    elements = np.arange(n, dtype=np.int64)
+    sources = np.concatenate((netlist.inputmap1, netlist.inputmap2, netlist.wide_inputs))
+    targets = np.concatenate(
+        (elements, elements, np.repeat(netlist.wide, np.diff(netlist.wide_ptr)))
+    )
+    connects = sources != n - 1
+    sources, targets = sources[connects], targets[connects]
+
+    label = elements.copy()
+    while True:
+        # propagate the smallest label along every edge, in both directions, and then jump to the label's label
+        smallest = np.minimum(label[sources], label[targets])
+        next_label = label.copy()
+        np.minimum.at(next_label, sources, smallest)
+        np.minimum.at(next_label, targets, smallest)
+        next_label = next_label[next_label]
+        if np.array_equal(next_label, label):
+            return label
+        label = next_label
+
+
+def partition(netlist, count) -> list:
+    """
+    Divide the elements of the netlist into count shards of roughly equal size.
+
+    The elements are ordered by connected region, and every cut between shards is moved to the nearest
+    region boundary, unless the region it falls in is larger than a shard. So only large regions are ever cut,
+    at the boundaries of index ranges. Returns a list of sorted index arrays.
+    """
+    label = regions(netlist)
+    order = np.argsort(label, kind="stable").astype(np.int32)
+    # the positions in order where a new region starts, including both ends
+    boundaries = np.flatnonzero(np.diff(label[order], prepend=-1, append=-1))
+    size = len(order) / count
+    cuts = []
+    for ideal in (round(size * k) for k in range(1, count)):
+        after = np.searchsorted(boundaries, ideal)
+        before = boundaries[after - 1] if boundaries[after] != ideal else ideal
+        after = boundaries[after]
+        if after - before <= size:
+            ideal = before if ideal - before <= after - ideal else after
+        cuts.append(ideal)
+    return [np.sort(shard) for shard in np.split(order, cuts) if shard.size]
+
+
+def _state_arrays(memory, n):
+    # input1, input2 and the two output buffers
+    state = np.ndarray((4, n), dtype=bool, buffer=memory.buf)
+    return state[0], state[1], state[2:]
+
+
+def _worker(connection, name, n, shard, lookup, operation, inputmap1, inputmap2, wide):
+    """
+    Serve step commands for a single shard until told to stop.
+
+    A ("step", gather_from, write_to) command first sets the inputs of the shard from output buffer gather_from
+    (unless it is None), then evaluates the shard into output buffer write_to (unless it is None)
+    and replies whether any output of the shard changed.
+    """
+    memory = shared_memory.SharedMemory(name=name)
+    input1, input2, outputs = _state_arrays(memory, n)
+    try:
+        while True:
+            command = connection.recv()
+            if command[0] == "stop":
+                break
+            _, gather_from, write_to = command
+            if gather_from is not None:
+                output = outputs[gather_from]
+                input1[shard] = output[inputmap1]
+                input2[shard] = output[inputmap2]
+                if wide is not None:
+                    gather_wide(output, input1, input2, *wide)
+            changed = False
+            if write_to is not None:
+                state = (
+                    input1[shard].view(np.uint8)
+                    + 2 * input2[shard].view(np.uint8)
+                    + operation
+                )
+                new_output = lookup[state]
+                changed = bool(np.any(new_output != outputs[1 - write_to][shard]))
+                outputs[write_to][shard] = new_output
+            connection.send(changed)
+    finally:
+        # the views must be gone before the shared memory can be closed
+        del input1, input2, outputs
+        memory.close()
+
+
+class ShardedSimulation:
+    """
+    Simulate a netlist with a pool of worker processes, one for every shard.
+
+    Every step gives exactly the same result as a step of the sync engine of a Simulation.
+    Use it as a context manager, or call close() to stop the workers and free the shared memory.
+    """
+
+    def __init__(self, netlist, workers=None):
+        self.netlist = netlist
+        self.n = netlist.n
+        self.shards = partition(netlist, workers or os.cpu_count() or 1)
+        # False if the last call to settle() stopped before the circuit was stable
+        self.settled = True
+
+        self._memory = shared_memory.SharedMemory(create=True, size=4 * self.n)
+        self.input1, self.input2, self._outputs = _state_arrays(self._memory, self.n)
+        self.input1[:] = self.input2[:] = self._outputs[:] = False
+        # the output buffer that holds the latest outputs
+        self._current = 0
+
+        # forking a process that runs threads (pygame, numba) is not safe, so start fresh interpreters
+        context = multiprocessing.get_context("spawn")
+        self._connections = []
+        self._processes = []
+        for shard in self.shards:
+            connection, worker_connection = context.Pipe()
+            process = context.Process(
+                target=_worker,
+                args=(worker_connection, self._memory.name, self.n, shard, *self._shard_arrays(shard)),
+                daemon=True,
+            )
+            process.start()
+            worker_connection.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+    def _shard_arrays(self, shard):
+        """
+        Return the parts of the netlist a worker needs to evaluate the given elements.
+        """
+        netlist = self.netlist
+        wide = None
+        member = np.zeros(self.n, dtype=bool)
+        member[shard] = True
+        positions = np.flatnonzero(member[netlist.wide])
+        if positions.size:
+            entries, segments = csr_ranges(netlist.wide_ptr, positions)
+            entries = netlist.wide_inputs[entries]
+            wide = (netlist.wide[positions], netlist.wide_reduction[positions], entries, segments)
+        return (
+            netlist.lookup,
+            netlist.operation[shard],
+            netlist.inputmap1[shard],
+            netlist.inputmap2[shard],
+            wide,
+        )
+
+    @property
+    def output(self) -> np.ndarray:
+        return self._outputs[self._current]
+
+    def set_inputs(self, values):
+        """
+        Set the Input elements to the given values, in the order of input_index.
+        """
+        index = self.netlist.input_index
+        self.input1[index] = self.input2[index] = values
+
+    def _command(self, gather_from, write_to) -> bool:
+        for connection in self._connections:
+            connection.send(("step", gather_from, write_to))
+        # every worker must reply before any shard may read the outputs it just wrote
+        return any([connection.recv() for connection in self._connections])
+
+    def step(self) -> bool:
+        """
+        Perform a single simulation step and return True if any output changed.
+        """
+        self.settle(1)
+        return not self.settled
+
+    def settle(self, max_steps=None) -> int:
+        """
+        Run simulation steps until no shard reports a change and return the number of steps taken.
+
+        Stops after max_steps steps even if the circuit did not settle yet.
+        """
+        if max_steps is None:
+            max_steps = self.n + 1
+        self.settled = False
+        steps = 0
+        gather_from = None  # the inputs are up to date before the first step
+        while steps < max_steps:
+            steps += 1
+            write_to = 1 - self._current
+            changed = self._command(gather_from, write_to)
+            self._current = gather_from = write_to
+            if not changed:
+                self.settled = True
+                break
+        if gather_from is not None:
+            self._command(gather_from, None)
+        return steps
+
+    def close(self):
+        """
+        Stop the workers and release the shared memory.
+        """
+        if self._memory is None:
+            return
+        for connection in self._connections:
+            connection.send(("stop",))
+        for process in self._processes:
+            process.join()
+        for connection in self._connections:
+            connection.close()
+        del self.input1, self.input2, self._outputs
+        self._memory.close()
+        self._memory.unlink()
+        self._memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
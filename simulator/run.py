@@ -0,0 +1,122 @@
+# Copyright 2024 - 2024, Michel Anders and the Digital Simulator contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Simulate a .dsim file without a display, for example:
+#
+#   python -m simulator.run adder.dsim --set a=1 --set b=1 --print outputs
+#
+# Only the geometry from model.py is used to connect the circuit, so pygame is never imported.
+
+import argparse
+import sys
+
+from simulator import binary
+from simulator.model import Input, Clock, Output, load_file
+from simulator.simulation import Simulation
+from simulator.backends import backends
+from simulator.cache import NetlistCache, default_directory
+
+
+def parse_assignment(text):
+    """
+    Split a NAME=VALUE argument into the name and a boolean value.
+    """
+    name, separator, value = text.partition("=")
+    if not separator or value not in ("0", "1"):
+        raise argparse.ArgumentTypeError(f"expected NAME=0 or NAME=1, not {text!r}")
+    return name, value == "1"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m simulator.run",
+        description="Simulate a Digital Simulator circuit without a display.",
+    )
+    parser.add_argument("file", help=f"the .dsim or {binary.EXT} file to simulate")
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        type=parse_assignment,
+        metavar="NAME=VALUE",
+        help="set all inputs with this label to 0 or 1, may be repeated",
+    )
+    parser.add_argument(
+        "--print",
+        action="append",
+        choices=("outputs", "inputs", "clocks", "all"),
+        help="the components whose values are printed, default outputs",
+    )
+    parser.add_argument(
+        "--cycles", type=int, default=0, help="the number of clock cycles to run after settling"
+    )
+    parser.add_argument("--max-steps", type=int, default=None, help="the maximum number of steps per settle")
+    parser.add_argument("--engine", choices=("sync", "event", "levelized"), default="levelized")
+    parser.add_argument("--backend", choices=sorted(backends), default="numpy")
+    parser.add_argument(
+        "--cache",
+        nargs="?",
+        const=default_directory(),
+        metavar="DIRECTORY",
+        help=f"reuse the connected circuit from an earlier run, stored in DIRECTORY (default {default_directory()})",
+    )
+    args = parser.parse_args(argv)
+
+    netlist = None
+    if args.file.endswith(binary.EXT):
+        arrays = binary.read(args.file)
+        netlist = binary.decode_netlist(arrays)
+    if netlist is not None:
+        # the file holds the connected circuit already, so only the labels of the terminals are needed
+        simulation = Simulation.from_netlist(netlist, args.engine, args.backend)
+        elements = {
+            "Input": iter(netlist.input_index.tolist()),
+            "Clock": iter(netlist.clock_index.tolist()),
+            "Output": iter(netlist.output_index.tolist()),
+        }
+        terminals = [(kind, label, next(elements[kind])) for kind, label in binary.terminals(arrays)]
+    else:
+        if args.file.endswith(binary.EXT):
+            components = binary.components(arrays)
+        else:
+            components = load_file(args.file)
+        cache = None if args.cache is None else NetlistCache(args.cache)
+        simulation = Simulation(
+            components, engine=args.engine, collapse=True, backend=args.backend, cache=cache
+        )
+        simulation.connect()
+        terminals = [
+            (type(component).__name__, component.label, element)
+            for component, element in zip(components, simulation.slot.tolist())
+            if isinstance(component, (Input, Clock, Output))
+        ]
+
+    inputs = {}
+    for kind, label, element in terminals:
+        if kind == "Input":
+            inputs.setdefault(label, []).append(element)
+    simulation.update_inputs()
+    for name, value in args.set:
+        if name not in inputs:
+            parser.error(f"there is no input labelled {name!r}")
+        # the state of the elements is set directly, nothing has been simulated yet
+        simulation.input1[inputs[name]] = simulation.input2[inputs[name]] = value
+    steps = simulation.settle(args.max_steps)
+    if args.cycles:
+        steps += simulation.run(args.cycles, args.max_steps)
+
+    kinds = {"outputs": ("Output",), "inputs": ("Input",), "clocks": ("Clock",)}
+    kinds["all"] = kinds["inputs"] + kinds["clocks"] + kinds["outputs"]
+    shown = {kind for name in args.print or ["outputs"] for kind in kinds[name]}
+    for kind, label, element in terminals:
+        if kind in shown:
+            print(f"{label}={int(simulation.output[element])}")
+
+    if not simulation.settled:
+        print(f"the circuit did not settle within {steps} steps", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,216 @@
 # Copyright 2024 - 2024, Michel Anders and the Digital Simulator contributors
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from simulator.component import Gate, AndGate, NandGate, Input, Output, Line
+from simulator.model import (
+    Gate,
+    AndGate,
+    NandGate,
+    OrGate,
+    NorGate,
+    XorGate,
+    Input,
+    Clock,
+    Output,
+    Line,
+)
+from simulator.backends import get_backend
+from simulator.cache import geometry_key
+from simulator.connections import Connections, overlap
 
 import numpy as np
 
-# TODO not all Line connections simulate correctly: some lead to infite repetitions
+
+ALL_LANES = np.uint64(0xFFFF_FFFF_FFFF_FFFF)
+
+# the operations used to combine the inputs of gates with more than 2 inputs, see Simulation.reductions
+AND, OR, XOR = range(3)
+
+
+def pack_patterns(patterns) -> np.ndarray:
+    """
+    Pack a (k, m) boolean array of k <= 64 patterns for m inputs into m uint64 words.
+
+    Pattern i ends up in bit i of every word.
+    """
+    patterns = np.asarray(patterns, dtype=bool)
+    k, m = patterns.shape
+    if k > 64:
+        raise ValueError("at most 64 patterns fit in a uint64 word")
+    padded = np.zeros((64, m), dtype=bool)
+    padded[:k] = patterns
+    packed = np.packbits(padded, axis=0, bitorder="little")  # (8, m) bytes
+    return np.ascontiguousarray(packed.T).view("<u8").ravel().astype(np.uint64)
+
+
+def unpack_patterns(words, k=64) -> np.ndarray:
+    """
+    Unpack m uint64 words into a (k, m) boolean array, the inverse of pack_patterns().
+    """
+    words = np.asarray(words, dtype="<u8")
+    bits = np.unpackbits(words.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    return bits.T[:k].astype(bool)
+
+
+def csr_ranges(ptr, rows) -> tuple:
+    """
+    Return the positions of the entries of the given rows in a compressed sparse row layout, concatenated,
+    together with the position in that concatenation where each row starts.
+
+    Row i holds the entries ptr[i]:ptr[i + 1]. A row may be given more than once.
+    """
+    starts = ptr[rows]
+    counts = ptr[rows + 1] - starts
+    segments = np.cumsum(counts) - counts
+    # the concatenation of the ranges start:start+count
+    offsets = np.repeat(starts - segments, counts)
+    return offsets + np.arange(int(counts.sum()), dtype=np.int32), segments
+
+
+def gather_wide(output, input1, input2, gates, reduction, entries, segments):
+    """
+    Set both inputs of the given gates with more than 2 inputs, see Simulation._gather_wide().
+
+    The inputs of gates[i] are the outputs of entries[segments[i]:segments[i+1]], combined with reduction[i].
+    """
+    values = output[..., entries]
+    result = np.bitwise_and.reduceat(values, segments, axis=-1)
+    if np.any(reduction == OR):
+        result = np.where(reduction == OR, np.bitwise_or.reduceat(values, segments, axis=-1), result)
+    if np.any(reduction == XOR):
+        result = np.where(reduction == XOR, np.bitwise_xor.reduceat(values, segments, axis=-1), result)
+    input1[..., gates] = result
+    input2[..., gates] = np.where(reduction == XOR, np.zeros_like(result), result)
+
+
+class TypeMap(dict):
+    """
+    A dict with classes as keys, in which a class without an entry uses the entry of its nearest base class.
+    """
+
+    def __missing__(self, key):
+        for base in key.__mro__[1:]:
+            if base in self:
+                self[key] = self[base]
+                return self[base]
+        raise KeyError(key)
+
+
+class Netlist:
+    """
+    The arrays that define a connected circuit, without any simulation state.
+
+    A netlist shares its arrays with the Simulation it was taken from and can be pickled,
+    so it can be handed to a backend or stored and turned into a new Simulation with Simulation.from_netlist().
+    """
+
+    fields = (
+        "lookup",
+        "operation",
+        "inputmap1",
+        "inputmap2",
+        "wide",
+        "wide_ptr",
+        "wide_inputs",
+        "wide_reduction",
+        "slot",
+        "input_index",
+        "output_index",
+        "clock_index",
+        "clock_period",
+        "clock_phase",
+    )
+
+    def __init__(self, **arrays):
+        for name in self.fields:
+            setattr(self, name, arrays[name])
+
+    @property
+    def n(self) -> int:
+        return len(self.operation)
 
 
 class Simulation:
-    def __init__(self, components):
+    def __init__(
+        self, components, engine="sync", collapse=False, backend=None, connections=None, cache=None
+    ):
         self.components = components
+        # the overlapping hotspots of the components, kept up to date by an editor (see simulator/connections.py).
+        # None finds them from scratch when connecting, with connections of its own
+        self.connections = connections
+        # remove Line and Output elements from the simulated arrays when connecting, see _collapse()
+        self.collapse = collapse
+        # a NetlistCache that remembers the arrays of circuits that were connected before, see connect()
+        self.cache = cache
+
+        self._allocate_arrays()
+
+        # the fanout of every element in compressed sparse row format, see _build_indices()
+        self.fanout_ptr = np.zeros(self.n + 1, dtype=np.int32)
+        self.fanout = np.zeros(0, dtype=np.int32)
+        # elements grouped by logic depth, see _build_indices(). None if the circuit has feedback
+        self.levels = None
+        # groups of elements that depend on each other's output, or single gates that read their own, see _find_cycles()
+        self.cycles = []
+        # False if the last call to settle() stopped before the circuit was stable
+        self.settled = True
+        # elements that must be evaluated by the event driven engine, None means all of them
+        self._pending = None
+        # the number of cycles simulated by run()
+        self.time = 0
+
+        # the algorithm used by settle()
+        self.engines = {
+            "sync": self._settle_sync,
+            "event": self._settle_event,
+            "levelized": self._settle_levelized,
+        }
+        if engine not in self.engines:
+            raise ValueError(f"unknown simulation engine {engine}")
+        self.engine = engine
+        # the code that performs full simulation steps, see simulator/backends.py. None selects the fastest available
+        self.backend = get_backend(backend)
+
+        # generate the lookup map
+        self.lookup = np.zeros(256, dtype=bool)
+        self.functions = {
+            0: lambda a, b: a and b,
+            4: lambda a, b: not (a and b),
+            8: lambda a, b: a or b,
+            12: lambda a, b: not (a or b),
+            16: lambda a, b: a != b,
+            # constants, used to force the output of an element to a fixed value (see simulator/faults.py)
+            24: lambda a, b: False,
+            28: lambda a, b: True,
+        }
+        # the drawables in component.py derive from these classes in model.py
+        self.functionsmap = TypeMap({
+            AndGate: 0,
+            NandGate: 4,
+            OrGate: 8,
+            NorGate: 12,
+            XorGate: 16,
+            Line: 0,
+            Input: 0,
+            Clock: 0,
+            Output: 0,
+        })
+        # gates with more than 2 inputs first combine all their inputs with one of these operations
+        # and then apply their function to the result, see _gather_wide()
+        self.reductions = {0: AND, 4: AND, 8: OR, 12: OR, 16: XOR}
 
-        self.n = len(self.components) + 1  # extra point because we will point unconnected inputs to this last spot (that will be set to always false)
+        for index, function in self.functions.items():
+            for a in (True, False):
+                for b in (True, False):
+                    offset = a + b * 2 + index
+                    self.lookup[offset] = function(a, b)
+
+        self.backend.compile(self.netlist())
+
+    def _allocate_arrays(self, n=None):
+        """
+        Allocate the simulation arrays, by default with one element for every component.
+        """
+        self.n = len(self.components) + 1 if n is None else n  # extra point because we will point unconnected inputs to this last spot (that will be set to always false)
         # gate inputs, maximum 2
         self.input1 = np.zeros(self.n, dtype=bool)
         self.input2 = np.zeros(self.n, dtype=bool)
@@ -23,122 +221,185 @@ class Simulation:
         self.inputmap1[:] = self.n-1
         self.inputmap2[:] = self.n-1
         # the result
-        self.output = np.ndarray(self.n, dtype=bool)
+        self.output = np.zeros(self.n, dtype=bool)
         # the logical operation. inputs, outputs and lines have 0 too (i.e. perform an and operation)
-        self.operation = np.zeros(self.n, dtype=np.int8)
+        self.operation = np.zeros(self.n, dtype=np.uint8)
+        # the element that holds the state of each component, see _collapse()
+        self.slot = np.arange(len(self.components), dtype=np.int32)
+        # gates with more than 2 inputs, in compressed sparse row format:
+        # the inputs of gate wide[i] are the outputs of wide_inputs[wide_ptr[i]:wide_ptr[i+1]]
+        self.wide = np.zeros(0, dtype=np.int32)
+        self.wide_ptr = np.zeros(1, dtype=np.int32)
+        self.wide_inputs = np.zeros(0, dtype=np.int32)
+        self.wide_reduction = np.zeros(0, dtype=np.uint8)
+        # the elements that hold the Input and Output components, set by connect()
+        self.input_index = np.zeros(0, dtype=np.int32)
+        self.output_index = np.zeros(0, dtype=np.int32)
+        # the elements that hold the Clock components and their period and phase in cycles, set by connect()
+        self.clock_index = np.zeros(0, dtype=np.int32)
+        self.clock_period = np.zeros(0, dtype=np.int64)
+        self.clock_phase = np.zeros(0, dtype=np.int64)
+        # the indices of the Input components and the states last copied to the components,
+        # see update_inputs() and update_components(). None until they are needed
+        self.input_components = None
+        self._states = None
+        self._allocate_buffers()
 
-        # generate the lookup map
-        self.lookup = np.zeros(256, dtype=np.int8)
-        self.functions = {0: lambda a, b: a and b, 4: lambda a, b: not (a or b)}
-        self.functionsmap = {AndGate: 0, NandGate: 4, Line: 0, Input: 0, Output: 0}
+    def _allocate_buffers(self):
+        """
+        Allocate the scratch arrays used by simulate_np() so that a simulation step does not allocate any memory.
+        """
+        # index into the lookup table for every element
+        self._state = np.zeros(self.n, dtype=np.uint8)
+        # the second half of the output double buffer
+        self._next_output = np.zeros(self.n, dtype=bool)
+        self._changed = np.zeros(self.n, dtype=bool)
 
-        for index, function in self.functions.items():
-            for a in (True, False):
-                for b in (True, False):
-                    offset = a + b * 2 + index
-                    self.lookup[offset] = function(a, b)
+    def _overlapping(self, component_index, connector_index, accept) -> list:
+        """
+        Return (component_index, connector_index) of the hotspots of other components that overlap the given hotspot,
+        limited to those for which accept(other_component, other_connector) is True.
+
+        The result is sorted, i.e. in the order a full scan over all components and connectors would produce.
+        """
+        return sorted(
+            (self._component_index[other_component], other_connector_index)
+            for other_component, other_connector_index in self._hotspots.overlapping(
+                self.components[component_index], connector_index
+            )
+            if accept(other_component, other_component.connectors[other_connector_index])
+        )
+
+    @staticmethod
+    def _produces_output(component, connector) -> bool:
+        return connector.direction in ("output", "bidirectional")
+
+    @staticmethod
+    def _joins_net(component, connector) -> bool:
+        # other Lines and the outputs that drive a net
+        return isinstance(component, Line) or connector.direction == "output"
 
     def _find_connections(self):
+        if self.connections is None:
+            self._hotspots = Connections(self.components)
+        else:
+            # only the components that were added since the last time still need to be looked at
+            self._hotspots = self.connections
+            self._hotspots.sync()
+        self._component_index = {
+            component: component_index for component_index, component in enumerate(self.components)
+        }
+        drivers = self._find_nets()
         for component_index, component in enumerate(self.components):
             if not isinstance(component, Line):
                 for connector_index, connector in enumerate(component.connectors):
                     if connector.direction == "input":
                         # if this connector may depend on the output of another drawable ...
                         component.connected = False
-                        # check all other drawables to see if may produce output
-                        for other_component_index, other_component in enumerate(
-                            self.components
-                        ):
-                            if (
-                                component is not other_component
-                            ):  # no connections to self are allowed
-                                for (
-                                    other_component_connector
-                                ) in other_component.connectors:
-                                    if other_component_connector.direction in (
-                                        "output",
-                                        "bidirectional",
-                                    ):
-                                        # if there is overlap between the connectors we add a listener to the drawable that produces output
-                                        if self.overlap(
-                                            component,
-                                            connector,
-                                            other_component,
-                                            other_component_connector,
-                                        ):
-                                            other_component.listeners.append(
-                                                (component, connector)
-                                            )
-                                            component.connected = True
-                                            component.inputmap.append(
-                                                other_component_index
-                                            )
+                        # check all overlapping hotspots to see if they may produce output
+                        for (
+                            other_component_index,
+                            other_connector_index,
+                        ) in self._overlapping(component_index, connector_index, self._produces_output):
+                            # we add a listener to the drawable that produces output
+                            other_component = self.components[other_component_index]
+                            other_component.listeners.append(
+                                (component, connector)
+                            )
+                            component.connected = True
+                            component.inputmap.append(
+                                other_component_index
+                            )
             else:  # Line objects are special
-                other_component_index = self._find_connected_output(component)
+                other_component_index = drivers.get(component_index)
                 if other_component_index is not None:
                     component.connected = True
                     component.inputmap.append(other_component_index)
 
-    def _find_connected_output(self, component):
-        visited = set()
-        queue = [component]
-        while len(queue):
-            component = queue.pop(0)
+    def _find_nets(self):
+        """
+        Group all Line objects into electrical nets and resolve the driver of each net.
 
-            if component in visited:
-                break
-            visited.add(component)
-
-            for other_component_index, other_component in enumerate(self.components):
-                if (
-                    component is not other_component
-                ):  # no connections to self are allowed
-
-                    # if one of the connectors overlaps with an output connector we are done
-                    for connector_index, connector in enumerate(component.connectors):
-                        for other_component_connector in other_component.connectors:
-                            if other_component_connector.direction == "output":
-                                # if there is overlap between the connectors we add a listener to the drawable that produces output
-                                if self.overlap(
-                                    component,
-                                    connector,
-                                    other_component,
-                                    other_component_connector,
-                                ):
-                                    return other_component_index
-                    # if not, and the other component is a Line, and we have overlap with it, we will follow that Line to see if it is connected to an output
-                    if isinstance(other_component, Line):
-                        for connector_index, connector in enumerate(component.connectors):
-                            for other_component_connector in other_component.connectors:
-                                if self.overlap(
-                                        component,
-                                        connector,
-                                        other_component,
-                                        other_component_connector,
-                                    ):
-                                    queue.append(other_component)
-                                    break
-        return None
+        Lines with overlapping endpoints are merged with a union-find (disjoint-set) structure,
+        after which a single pass over the Lines looks for output connectors that touch the net.
+        Returns a dict that maps the index of every driven Line to the index of its driver.
+        If a net touches more than one output, the component with the lowest index wins.
+        """
+        parent = list(range(len(self.components)))
+
+        def find(index):
+            while parent[index] != index:
+                parent[index] = parent[parent[index]]  # path halving
+                index = parent[index]
+            return index
+
+        lines = [
+            (component_index, component)
+            for component_index, component in enumerate(self.components)
+            if isinstance(component, Line)
+        ]
+        drivers = {}
+        for component_index, component in lines:
+            for connector_index in range(len(component.connectors)):
+                for (
+                    other_component_index,
+                    other_connector_index,
+                ) in self._overlapping(component_index, connector_index, self._joins_net):
+                    if isinstance(self.components[other_component_index], Line):
+                        parent[find(other_component_index)] = find(component_index)
+                    else:
+                        drivers[component_index] = min(
+                            other_component_index,
+                            drivers.get(component_index, other_component_index),
+                        )
+
+        # every Line inherits the driver of its net
+        net_drivers = {}
+        for component_index, driver in drivers.items():
+            root = find(component_index)
+            net_drivers[root] = min(driver, net_drivers.get(root, driver))
+        return {
+            component_index: net_drivers[find(component_index)]
+            for component_index, _ in lines
+            if find(component_index) in net_drivers
+        }
 
     def connect(self):
-        # TODO detect circular dependencies
+        """
+        Find out how the components are connected and fill the simulation arrays.
+
+        With a cache (see simulator/cache.py) the arrays of a circuit that was connected before are read back instead.
+        The listeners and inputmap of the components are only set when the circuit is actually connected.
+        """
+        if self.cache is None:
+            self._connect()
+            return
+        key = geometry_key(self.components, self.collapse)
+        netlist = self.cache.get(key)
+        if netlist is None:
+            self._connect()
+            self.cache.put(key, self.netlist())
+        else:
+            self._use_netlist(netlist)
+
+    def _connect(self):
+        self._allocate_arrays()
         for component in self.components:
             component.listeners = []
             component.inputmap = []
 
         self._find_connections()
 
+        wide = []
         for component_index, component in enumerate(self.components):
             self.operation[component_index] = self.functionsmap[type(component)]
 
-            if type(component) in (
-                Input,
-            ):  # may be extended with other inputs like Clock
+            if isinstance(component, (Input, Clock)):
                 # we map its output back to both its own inputs and because function associated with an input is 'and' , this input then stays the same for the duration of the simulation
                 self.inputmap1[component_index] = self.inputmap2[component_index] = (
                     component_index
                 )
-            elif type(component) in (Output,):
+            elif isinstance(component, Output):
                 self.input1[component_index] = self.input2[component_index] = 0
                 for connector_index, other_component_index in enumerate(
                     component.inputmap
@@ -148,7 +409,7 @@ class Simulation:
                         self.inputmap2[component_index] = other_component_index
                     else:
                         raise IndexError("Output objects can have only 1 input")
-            elif type(component) in (Line,):
+            elif isinstance(component, Line):
                 self.input1[component_index] = self.input2[component_index] = 0
                 for connector_index, other_component_index in enumerate(
                     component.inputmap
@@ -159,6 +420,12 @@ class Simulation:
                     else:
                         print(f"{component_index=} {other_component_index=}")
                         raise IndexError("Line objects can have only 1 input")
+            elif component.inputs > 2:
+                # unconnected inputs read from the dummy element
+                sources = component.inputmap[: component.inputs]
+                wide.append(
+                    (component_index, sources + [self.n - 1] * (component.inputs - len(sources)))
+                )
             else:
                 for connector_index, other_component_index in enumerate(
                     component.inputmap
@@ -168,6 +435,215 @@ class Simulation:
                     else:
                         self.inputmap2[component_index] = other_component_index
 
+        if wide:
+            self.wide = np.array([gate for gate, _ in wide], dtype=np.int32)
+            self.wide_ptr = np.zeros(len(wide) + 1, dtype=np.int32)
+            np.cumsum([len(sources) for _, sources in wide], out=self.wide_ptr[1:])
+            self.wide_inputs = np.array(
+                [source for _, sources in wide for source in sources], dtype=np.int32
+            )
+            self.wide_reduction = np.array(
+                [self.reductions[self.operation[gate]] for gate in self.wide], dtype=np.uint8
+            )
+
+        if self.collapse:
+            self._collapse()
+
+        # the elements whose values are set from outside or read back as the result of a simulation
+        inputs = [i for i, c in enumerate(self.components) if isinstance(c, Input)]
+        self.input_components = np.array(inputs, dtype=np.int32)
+        self.input_index = self.slot[inputs]
+        self.output_index = self.slot[
+            [i for i, c in enumerate(self.components) if isinstance(c, Output)]
+        ]
+        clocks = [i for i, c in enumerate(self.components) if isinstance(c, Clock)]
+        self.clock_index = self.slot[clocks]
+        self.clock_period = np.array([self.components[i].period for i in clocks], dtype=np.int64)
+        self.clock_phase = np.array([self.components[i].phase for i in clocks], dtype=np.int64)
+
+        self._build_indices()
+
+    def _collapse(self):
+        """
+        Remove the elements that only pass on a value from the simulated arrays.
+
+        Line and Output elements copy the output of their driver. Every element that reads from them
+        reads directly from the ultimate driver instead, and the state of the forwarding components
+        is read back through the slot array, which maps a component to the element holding its state.
+        This makes the arrays smaller and a signal no longer needs an extra step for every wire segment.
+        """
+        count = len(self.components)
+        elements = np.arange(self.n, dtype=np.int32)
+        forwarding = np.zeros(self.n, dtype=bool)
+        forwarding[:count] = [isinstance(c, (Line, Output)) for c in self.components]
+
+        # pointer jumping: after k rounds every element points 2**k steps further along its chain of drivers
+        root = np.where(forwarding, self.inputmap1, elements)
+        for _ in range(self.n.bit_length() + 1):
+            next_root = root[root]
+            if np.array_equal(next_root, root):
+                break
+            root = next_root
+        # a loop of wires without a driver is not driven at all
+        root[forwarding[root]] = self.n - 1
+
+        keep = ~forwarding
+        new_index = np.cumsum(keep, dtype=np.int32) - 1
+        inputmap1 = new_index[root[self.inputmap1[keep]]]
+        inputmap2 = new_index[root[self.inputmap2[keep]]]
+        operation = self.operation[keep]
+        slot = new_index[root[:count]]
+        wide = new_index[self.wide]
+        wide_ptr = self.wide_ptr
+        wide_inputs = new_index[root[self.wide_inputs]]
+        wide_reduction = self.wide_reduction
+
+        self._allocate_arrays(int(keep.sum()))
+        self.inputmap1[:] = inputmap1
+        self.inputmap2[:] = inputmap2
+        self.operation[:] = operation
+        self.slot = slot
+        self.wide = wide
+        self.wide_ptr = wide_ptr
+        self.wide_inputs = wide_inputs
+        self.wide_reduction = wide_reduction
+
+    def _build_indices(self):
+        """
+        Derive the index structures the simulation engines need from the input maps.
+
+        Must be called again whenever inputmap1 or inputmap2 change.
+        """
+        # fanout: for element i, fanout[fanout_ptr[i]:fanout_ptr[i+1]] are the elements that read its output
+        elements = np.arange(self.n, dtype=np.int64)
+        sources = np.concatenate((self.inputmap1, self.inputmap2, self.wide_inputs))
+        targets = np.concatenate(
+            (elements, elements, np.repeat(self.wide, np.diff(self.wide_ptr)))
+        )
+        # every (source, target) pair once, sorted by source
+        edges = np.unique(sources.astype(np.int64) * self.n + targets)
+        self.fanout = (edges % self.n).astype(np.int32)
+        self.fanout_ptr = np.zeros(self.n + 1, dtype=np.int32)
+        np.cumsum(np.bincount(edges // self.n, minlength=self.n), out=self.fanout_ptr[1:])
+
+        # the position of each gate with more than 2 inputs in the wide arrays, -1 for all other elements
+        self._wide_position = np.full(self.n, -1, dtype=np.int32)
+        self._wide_position[self.wide] = np.arange(len(self.wide), dtype=np.int32)
+        self._pending = None
+
+        self.levels, unplaced = self._levelize()
+        # every element on a cycle, a gate that reads its own output included, is left unplaced
+        self.cycles = self._find_cycles(unplaced)
+        self.backend.compile(self.netlist())
+
+    def netlist(self) -> Netlist:
+        """
+        Return the arrays that define the connected circuit.
+        """
+        return Netlist(**{name: getattr(self, name) for name in Netlist.fields})
+
+    @classmethod
+    def from_netlist(cls, netlist, engine="sync", backend=None, components=()):
+        """
+        Create a Simulation that simulates the given netlist, without connecting any components.
+
+        The state of its elements can be read and written through input_index and output_index.
+        If the components the netlist was made from are given, update_inputs() and update_components() work as usual.
+        """
+        simulation = cls(list(components), engine=engine, backend=backend)
+        simulation._use_netlist(netlist)
+        return simulation
+
+    def _use_netlist(self, netlist):
+        self._allocate_arrays(netlist.n)
+        for name in Netlist.fields:
+            setattr(self, name, np.array(getattr(netlist, name)))
+        self._build_indices()
+
+    def _levelize(self):
+        """
+        Sort the elements topologically into levels.
+
+        Level 0 holds the elements whose values are set from outside (Input and Clock elements and the dummy element),
+        every other element is in the level after the highest level of the elements it reads from.
+        A gate that reads its own output is not a source but a cycle, even if it reads nothing else.
+        Returns a list of index arrays, or None if the circuit contains feedback,
+        together with a boolean array that marks the elements that could not be placed in a level.
+        """
+        elements = np.arange(self.n, dtype=np.int32)
+        source = np.zeros(self.n, dtype=bool)
+        source[self.input_index] = source[self.clock_index] = True
+        source[self.n - 1] = True
+        # the number of distinct elements each element still waits for
+        indegree = np.bincount(self.fanout, minlength=self.n).astype(np.int32)
+        indegree[source] = 0
+        frontier = elements[source]
+        levels = []
+        done = 0
+        while frontier.size:
+            levels.append(frontier)
+            done += frontier.size
+            targets = self._fanout_entries(frontier)
+            targets, counts = np.unique(targets[~source[targets]], return_counts=True)
+            indegree[targets] -= counts
+            frontier = targets[indegree[targets] == 0]
+        unplaced = indegree > 0
+        if done < self.n:
+            return None, unplaced
+        return levels, unplaced
+
+    def _find_cycles(self, candidates):
+        """
+        Return the strongly connected components that contain a cycle, as a list of sorted index arrays.
+
+        Only the candidate elements are considered; elements that could be placed in a level are never part of a cycle.
+        Uses an iterative version of Tarjan's algorithm.
+        """
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        cycles = []
+
+        def successors(element):
+            readers = self.fanout[self.fanout_ptr[element] : self.fanout_ptr[element + 1]]
+            return [reader for reader in readers.tolist() if candidates[reader]]
+
+        for start in np.flatnonzero(candidates).tolist():
+            if start in index:
+                continue
+            index[start] = lowlink[start] = len(index)
+            stack.append(start)
+            on_stack.add(start)
+            work = [(start, iter(successors(start)))]
+            while work:
+                element, readers = work[-1]
+                for reader in readers:
+                    if reader not in index:
+                        index[reader] = lowlink[reader] = len(index)
+                        stack.append(reader)
+                        on_stack.add(reader)
+                        work.append((reader, iter(successors(reader))))
+                        break
+                    elif reader in on_stack:
+                        lowlink[element] = min(lowlink[element], index[reader])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[element])
+                    if lowlink[element] == index[element]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == element:
+                                break
+                        if len(component) > 1 or element in successors(element):
+                            cycles.append(np.array(sorted(component), dtype=np.int32))
+        return cycles
+
     def _dump(self):  # pragma: no cover
         print([f"{i}:{type(c).__name__}" for i, c in enumerate(self.components, start=1)])
         print(f"{self.input1=}")
@@ -176,41 +652,358 @@ class Simulation:
         print(f"{self.inputmap2=}")
         print(f"{self.output=}")
 
+    def _gather_wide(self, output, input1, input2, elements=None):
+        """
+        Set both inputs of the gates with more than 2 inputs from the given output array.
+
+        The outputs read by each gate are combined with its reduction, and the lookup table then applies
+        the gate's function to the combined value: for AND and OR as both inputs, for XOR as input1 with input2 False.
+        Works on 1-D arrays and on arrays with a leading batch dimension, both bool and packed uint64.
+        If elements is given, only the wide gates among those elements are updated.
+        """
+        if not self.wide.size:
+            return
+        if elements is None:
+            gates = self.wide
+            reduction = self.wide_reduction
+            entries = self.wide_inputs
+            segments = self.wide_ptr[:-1]
+        else:
+            positions = self._wide_position[elements]
+            positions = positions[positions >= 0]
+            if not positions.size:
+                return
+            gates = self.wide[positions]
+            reduction = self.wide_reduction[positions]
+            entries, segments = csr_ranges(self.wide_ptr, positions)
+            entries = self.wide_inputs[entries]
+
+        gather_wide(output, input1, input2, gates, reduction, entries, segments)
+
     def simulate_np(self) -> bool:
-        # print("simulate")
-        # self._dump()
-        # print("-"*20)
+        """
+        Perform a single simulation step and return True if any output changed.
 
-        state = self.input1 + 2 * self.input2 + self.operation
-        previous_output = self.output
-        self.output = self.lookup[state]
-        # TODO these could be done in-place, i.e. put into the input array directly, to save allocating a new array
-        self.input1 = self.output[self.inputmap1]
-        self.input2 = self.output[self.inputmap2]
+        The work is done by the backend selected with the backend argument, see simulator/backends.py.
+        """
+        return self.backend.step(self)
 
-        # self._dump()
-        # print("-"*20)
+    def settle(self, max_steps=None) -> int:
+        """
+        Run simulation steps until no output changes anymore and return the number of steps taken.
 
-        return np.any(previous_output != self.output)
+        Stops after max_steps steps even if the circuit did not settle yet.
+        The default is enough for any circuit without feedback.
+        The work is done by the engine selected with the engine attribute.
+        """
+        if max_steps is None:
+            max_steps = self.n + 1
+        return self.engines[self.engine](max_steps)
 
-    def update_components(self):
-        for component, output in zip(self.components, self.output):
-            component.state = bool(output)
+    def _settle_sync(self, max_steps) -> int:
+        """
+        Settle by evaluating all elements in every step.
+        """
+        return self.backend.settle(self, max_steps)
 
-    def update_inputs(self):
-        for component_index, component in enumerate(self.components):
-            if type(component) in (
-                Input,
-            ):  # may be extended with other inputs like Clock
-                self.input1[component_index] = self.input2[component_index] = (
-                    component.state
+    def _fanout_entries(self, elements) -> np.ndarray:
+        """
+        Return the concatenated fanout of the given elements, an element may occur more than once.
+        """
+        return self.fanout[csr_ranges(self.fanout_ptr, elements)[0]]
+
+    def _fanout_of(self, elements) -> np.ndarray:
+        """
+        Return the sorted unique elements that read the output of any of the given elements.
+        """
+        return np.unique(self._fanout_entries(elements))
+
+    def _settle_event(self, max_steps) -> int:
+        """
+        Settle by evaluating only elements whose inputs changed in the previous step.
+
+        Every step produces exactly the same outputs as a step of the sync engine,
+        but the cost of a step is proportional to the number of changed elements and their fanout.
+        """
+        if self._pending is None:
+            active = np.arange(self.n, dtype=np.int32)
+        else:
+            active = np.fromiter(sorted(self._pending), dtype=np.int32, count=len(self._pending))
+        self._pending = set()
+
+        self.settled = False
+        steps = 0
+        while steps < max_steps:
+            steps += 1
+            state = (
+                self.input1[active].view(np.uint8)
+                + 2 * self.input2[active].view(np.uint8)
+                + self.operation[active]
+            )
+            new_output = self.lookup[state]
+            changed = active[new_output != self.output[active]]
+            if changed.size == 0:
+                self.settled = True
+                break
+            self.output[changed] = ~self.output[changed]
+            active = self._fanout_of(changed)
+            self.input1[active] = self.output[self.inputmap1[active]]
+            self.input2[active] = self.output[self.inputmap2[active]]
+            self._gather_wide(self.output, self.input1, self.input2, active)
+        else:
+            # we stopped before the circuit settled, so these still need to be evaluated
+            self._pending.update(active.tolist())
+        return steps
+
+    def _settle_levelized(self, max_steps) -> int:
+        """
+        Settle an acyclic circuit in a single sweep by evaluating it level by level.
+
+        Every element is evaluated exactly once, after all the elements it reads from.
+        Circuits with feedback fall back to the sync engine.
+        """
+        if self.levels is None:
+            return self._settle_sync(max_steps)
+        for level, elements in enumerate(self.levels):
+            if level:  # level 0 elements keep the inputs they were given
+                self.input1[elements] = self.output[self.inputmap1[elements]]
+                self.input2[elements] = self.output[self.inputmap2[elements]]
+                self._gather_wide(self.output, self.input1, self.input2, elements)
+            state = (
+                self.input1[elements].view(np.uint8)
+                + 2 * self.input2[elements].view(np.uint8)
+                + self.operation[elements]
+            )
+            self.output[elements] = self.lookup[state]
+        np.take(self.output, self.inputmap1, out=self.input1, mode="clip")
+        np.take(self.output, self.inputmap2, out=self.input2, mode="clip")
+        self._gather_wide(self.output, self.input1, self.input2)
+        self._pending = set()  # every element is up to date now
+        self.settled = True
+        return 1
+
+    def find_oscillation(self, max_steps=None):
+        """
+        Settle the circuit with single steps while watching for a repeating sequence of states.
+
+        Every output state is packed into bits and remembered by its hash. Because the outputs determine
+        all following states, seeing a state again means the circuit oscillates.
+        Returns None if the circuit settled (or did not repeat within max_steps steps),
+        otherwise a tuple with the period and an array of the elements that change during one period.
+        """
+        if max_steps is None:
+            max_steps = self.n + 1
+        seen = {}
+        for step in range(max_steps):
+            if not self.simulate_np():
+                self.settled = True
+                return None
+            key = hash(np.packbits(self.output).tobytes())
+            if key in seen:
+                break
+            seen[key] = step
+        else:
+            self.settled = False
+            return None
+
+        # verify the period (hashes can collide) and collect the elements that toggle along the way
+        period = step - seen[key]
+        start = self.output.copy()
+        toggled = np.zeros(self.n, dtype=bool)
+        for _ in range(period):
+            previous = self.output.copy()
+            self.simulate_np()
+            toggled |= previous != self.output
+        self.settled = False
+        if not np.array_equal(start, self.output):
+            return None
+        return period, np.flatnonzero(toggled)
+
+    def run_batch(self, stimuli, max_steps=None) -> np.ndarray:
+        """
+        Settle the circuit for k input vectors at once and return the values of the Output components.
+
+        stimuli is a (k, number of inputs) boolean array with the values of the Input components
+        in the order of input_index. All vectors are simulated together on (k, n) state arrays,
+        in a single sweep if the circuit has no feedback, otherwise for at most max_steps steps.
+        Returns a (k, number of outputs) boolean array in the order of output_index.
+        The interactive state of the simulation is not affected.
+        """
+        stimuli = np.asarray(stimuli, dtype=bool)
+        if stimuli.ndim != 2 or stimuli.shape[1] != len(self.input_index):
+            raise ValueError(
+                f"stimuli should have shape (k, {len(self.input_index)}), not {stimuli.shape}"
+            )
+        if max_steps is None:
+            max_steps = self.n + 1
+        k = stimuli.shape[0]
+        input1 = np.zeros((k, self.n), dtype=bool)
+        input2 = np.zeros((k, self.n), dtype=bool)
+        input1[:, self.input_index] = input2[:, self.input_index] = stimuli
+        output = np.zeros((k, self.n), dtype=bool)
+
+        if self.levels is not None:
+            for level, elements in enumerate(self.levels):
+                if level:  # level 0 elements keep the inputs they were given
+                    input1[:, elements] = output[:, self.inputmap1[elements]]
+                    input2[:, elements] = output[:, self.inputmap2[elements]]
+                    self._gather_wide(output, input1, input2, elements)
+                state = (
+                    input1[:, elements].view(np.uint8)
+                    + 2 * input2[:, elements].view(np.uint8)
+                    + self.operation[elements]
                 )
+                output[:, elements] = self.lookup[state]
+        else:
+            state = np.zeros((k, self.n), dtype=np.uint8)
+            next_output = np.zeros((k, self.n), dtype=bool)
+            for _ in range(max_steps):
+                np.add(input2.view(np.uint8), input2.view(np.uint8), out=state)
+                np.add(state, input1.view(np.uint8), out=state)
+                np.add(state, self.operation, out=state)
+                np.take(self.lookup, state, out=next_output, mode="clip")
+                np.take(next_output, self.inputmap1, axis=1, out=input1, mode="clip")
+                np.take(next_output, self.inputmap2, axis=1, out=input2, mode="clip")
+                self._gather_wide(next_output, input1, input2)
+                changed = not np.array_equal(output, next_output)
+                output, next_output = next_output, output
+                if not changed:
+                    break
+        return output[:, self.output_index]
+
+    def _packed_masks(self):
+        """
+        Return a (4, n) array of uint64 masks, one row for every combination of input values.
+
+        Row a + 2 * b is all ones for the elements whose function returns True for inputs a and b,
+        which turns every function in the lookup table into a bitwise operation on 64 lanes at once.
+        """
+        table = self.lookup[self.operation[np.newaxis, :] + np.arange(4, dtype=np.uint8)[:, np.newaxis]]
+        return np.where(table, ALL_LANES, np.uint64(0))
+
+    def settle_packed(self, words, max_steps=None, stuck_at=None) -> np.ndarray:
+        """
+        Settle the circuit for up to 64 input patterns at once.
+
+        words holds one uint64 per Input component (in the order of input_index),
+        with bit i holding the value of that input in pattern i.
+        stuck_at is an optional pair of uint64 arrays with a word for every element: the lanes in which the output
+        of that element is forced to 0 and the lanes in which it is forced to 1, see simulator/faults.py.
+        Returns the packed output words of all elements, use output_index to select the Output components.
+        The interactive state of the simulation is not affected.
+        """
+        if max_steps is None:
+            max_steps = self.n + 1
+        m0, m1, m2, m3 = masks = self._packed_masks()
+        if stuck_at is not None:
+            # a stuck element ignores its inputs: its function returns the same value for every input combination
+            zero, one = stuck_at
+            np.bitwise_and(masks, ~(zero | one), out=masks)
+            np.bitwise_or(masks, one, out=masks)
+        input1 = np.zeros(self.n, dtype=np.uint64)
+        input2 = np.zeros(self.n, dtype=np.uint64)
+        input1[self.input_index] = input2[self.input_index] = words
+        output = np.zeros(self.n, dtype=np.uint64)
+        next_output = np.zeros(self.n, dtype=np.uint64)
+        not_input = np.zeros(self.n, dtype=np.uint64)
+        low = np.zeros(self.n, dtype=np.uint64)
+        high = np.zeros(self.n, dtype=np.uint64)
+
+        for _ in range(max_steps):
+            # low = lanes where input2 is 0, high = lanes where input2 is 1
+            np.invert(input1, out=not_input)
+            np.bitwise_and(m0, not_input, out=low)
+            np.bitwise_or(low, np.bitwise_and(m1, input1, out=next_output), out=low)
+            np.bitwise_and(m2, not_input, out=high)
+            np.bitwise_or(high, np.bitwise_and(m3, input1, out=next_output), out=high)
+            np.bitwise_and(high, input2, out=high)
+            np.invert(input2, out=not_input)
+            np.bitwise_and(low, not_input, out=low)
+            np.bitwise_or(low, high, out=next_output)
+
+            np.take(next_output, self.inputmap1, out=input1, mode="clip")
+            np.take(next_output, self.inputmap2, out=input2, mode="clip")
+            self._gather_wide(next_output, input1, input2)
+            changed = not np.array_equal(output, next_output)
+            output, next_output = next_output, output
+            if not changed:
+                break
+        return output
+
+    def update_components(self) -> list:
+        """
+        Copy the outputs of the elements to the state of their components and return the components that changed.
+        """
+        states = self.output[self.slot]
+        if self._states is None:
+            self._states = np.array([component.state for component in self.components], dtype=bool)
+        # only the components whose element changed since the last call are touched
+        changed = np.flatnonzero(states != self._states)
+        self._states = states
+        components = [self.components[index] for index in changed.tolist()]
+        for component, state in zip(components, states[changed].tolist()):
+            component.state = state
+        return components
+
+    def update_inputs(self):
+        """
+        Copy the state of the Input components to their elements and set the clocks.
+
+        If any of them changed, the circuit is no longer settled, so the next run() settles it even without a clock edge.
+        """
+        if self.input_components is None:
+            self.input_components = np.array(
+                [i for i, c in enumerate(self.components) if isinstance(c, Input)], dtype=np.int32
+            )
+        components = self.components
+        states = np.array(
+            [components[index].state for index in self.input_components.tolist()], dtype=bool
+        )
+        elements = self.slot[self.input_components]
+        changed = elements[self.input1[elements] != states]
+        if self._pending is not None:
+            self._pending.update(changed.tolist())
+        self.input1[elements] = self.input2[elements] = states
+        if self._set_clocks() or changed.size:
+            self.settled = False
+
+    def _set_clocks(self) -> bool:
+        """
+        Set the Clock elements to their value at the current time and return True if any of them changed.
+
+        A clock is low during the first half of its period and high during the second half.
+        """
+        if not self.clock_index.size:
+            return False
+        elements = self.clock_index
+        values = (self.time + self.clock_phase) % self.clock_period * 2 >= self.clock_period
+        changed = elements[self.input1[elements] != values]
+        if not changed.size:
+            return False
+        if self._pending is not None:
+            self._pending.update(changed.tolist())
+        self.input1[elements] = self.input2[elements] = values
+        return True
+
+    def run(self, cycles, max_steps=None) -> int:
+        """
+        Advance the time by the given number of cycles, settling the circuit after every clock edge.
+
+        Only the simulation arrays are updated, call update_components() afterwards to show the result.
+        max_steps limits the number of steps for every settle, see settle().
+        Returns the total number of simulation steps.
+        """
+        steps = 0
+        for _ in range(cycles):
+            self.time += 1
+            # a cycle without an edge needs no work, unless the last settle was cut short
+            if self._set_clocks() or not self.settled:
+                steps += self.settle(max_steps)
+        return steps
 
     @staticmethod
     def overlap(a, c1, b, c2) -> bool:
         """
         Check if hotspot c1 of component a overlaps with hotspot c2 of component b.
         """
-        ap = a.pos + c1.position
-        bp = b.pos + c2.position
-        return (ap - bp).length() <= (c1.radius + c2.radius)
+        return overlap(a.pos + c1.position, c1.radius, b.pos + c2.position, c2.radius)
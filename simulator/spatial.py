@@ -0,0 +1,115 @@
+# Copyright 2024 - 2024, Michel Anders and the Digital Simulator contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# A uniform grid over the screen that finds the drawables at a point without looking at all of them.
+#
+# Every drawable is entered in all cells that its bounding box touches, where the bounding box includes
+# the circles of its connectors, which stick out of its rect. A click only has to test the drawables in a single cell,
+# in the order they have in the list of drawables, so the first hit is the same as with a scan over the whole list.
+
+from abc import ABC, abstractmethod
+
+
+class AppendOnlyIndex(ABC):
+    """
+    The base of an index over a list of items that the index does not own.
+
+    The list may only grow by appending, which sync() picks up; if it shrank, the index is rebuilt.
+    Subclasses set up their empty structures in clear() and enter a single item in append().
+    """
+
+    def __init__(self, items):
+        self.items = items
+        # the number of items of the list that are in the index
+        self.count = 0
+        self.clear()
+        self.sync()
+
+    @abstractmethod
+    def clear(self):
+        """
+        Set up the empty structures of the index.
+        """
+
+    @abstractmethod
+    def append(self, index, item):
+        """
+        Enter the item at the given index of the list in the index.
+        """
+
+    def sync(self):
+        """
+        Add the items that were appended to the list since the last call.
+        """
+        if len(self.items) < self.count:
+            # not just appended to, so start over
+            self.count = 0
+            self.clear()
+        for index in range(self.count, len(self.items)):
+            self.append(index, self.items[index])
+        self.count = len(self.items)
+
+
+class SpatialIndex(AppendOnlyIndex):
+    """
+    The drawables of a list, indexed by the grid cells they cover.
+
+    Drawables that move or rotate must be passed to move().
+    """
+
+    def __init__(self, drawables, cell=64):
+        self.cell = cell
+        super().__init__(drawables)
+
+    def clear(self):
+        # cell -> drawables that touch it, drawable -> its cells and drawable -> position in the list
+        self.cells = {}
+        self.covers = {}
+        self.order = {}
+
+    def append(self, index, drawable):
+        self.order.setdefault(drawable, index)
+        self.add(drawable)
+
+    def bounds(self, drawable) -> tuple:
+        """
+        Return the left, top, right and bottom of the area covered by the drawable and its connectors.
+        """
+        rect = drawable.rect()
+        left, top, right, bottom = rect.left, rect.top, rect.right, rect.bottom
+        x, y = rect.center
+        for hotspot in drawable.connectors:
+            r = hotspot.radius
+            left = min(left, x + hotspot.position[0] - r)
+            top = min(top, y + hotspot.position[1] - r)
+            right = max(right, x + hotspot.position[0] + r + 1)
+            bottom = max(bottom, y + hotspot.position[1] + r + 1)
+        return left, top, right, bottom
+
+    def add(self, drawable):
+        cell = self.cell
+        left, top, right, bottom = self.bounds(drawable)
+        covers = [
+            (i, j)
+            for i in range(int(left // cell), int((right - 1) // cell) + 1)
+            for j in range(int(top // cell), int((bottom - 1) // cell) + 1)
+        ]
+        for key in covers:
+            self.cells.setdefault(key, set()).add(drawable)
+        self.covers[drawable] = covers
+
+    def move(self, drawable):
+        """
+        Update the cells of a drawable after its position or orientation changed.
+        """
+        for key in self.covers.pop(drawable, ()):
+            self.cells[key].discard(drawable)
+        self.add(drawable)
+
+    def at(self, pos) -> list:
+        """
+        Return the drawables whose area may contain pos, in the order of the list of drawables.
+        """
+        self.sync()
+        key = (int(pos[0] // self.cell), int(pos[1] // self.cell))
+        return sorted(self.cells.get(key, ()), key=self.order.__getitem__)
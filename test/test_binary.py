@@ -0,0 +1,116 @@
+import json
+
+import numpy as np
+import pytest
+
+from simulator import binary, model
+from simulator.component import (
+    AndGate,
+    XorGate,
+    Input,
+    Clock,
+    Output,
+    Line,
+    ComponentEncoder,
+)
+from simulator.run import main
+
+
+class TestBinary:
+    @pytest.fixture()
+    def circuit(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        drawables = [
+            AndGate((200, 300)),
+            Input((100, 290), label="a"),
+            Input((100, 310), label="b"),
+            Output((300, 300), label="y"),
+            Line((120, 290), (160, 290)),
+            Line((120, 310), (160, 310)),
+            Line((240, 300), (280, 300)),
+            XorGate((500, 500), 90, label="wide ü", inputs=4),
+            Clock((400, 100), 270, period=8, phase=3),
+            Line((600, 100), (600, 160)),
+        ]
+        library = [Input((50, 100)), XorGate((50, 100))]
+        return json.loads(json.dumps({"drawables": drawables, "library": library}, cls=ComponentEncoder))
+
+    def test_roundtrip(self, circuit, tmp_path):
+        path = tmp_path / "circuit.dsimb"
+        binary.save(path, circuit)
+        assert binary.load(path) == circuit
+        # angles come back as ints, like the editor saves them
+        assert [d["dict"]["angle"] for d in binary.load(path)["drawables"]] == [0] * 7 + [90, 270, 90]
+        assert all(type(d["dict"]["angle"]) is int for d in binary.load(path)["drawables"])
+        # and so do integral coordinates, so a .dsim file with ints has the same text after converting it back
+        text = json.dumps(
+            {
+                "drawables": [
+                    {"type": "Input", "dict": {"pos": [100, 290], "angle": 0, "label": "a"}},
+                    {"type": "Line", "dict": {"start": [120, 290], "end": [160.5, 290], "angle": 0, "label": ""}},
+                ],
+                "library": [],
+            }
+        )
+        binary.save(tmp_path / "ints.dsimb", json.loads(text))
+        assert json.dumps(binary.load(tmp_path / "ints.dsimb")) == text
+
+        # a component without a label keeps its default label, instead of getting an empty one
+        unlabelled = {"drawables": [{"type": "Output", "dict": {"pos": [100, 290], "angle": 0}}], "library": []}
+        binary.save(tmp_path / "unlabelled.dsimb", unlabelled)
+        assert binary.load(tmp_path / "unlabelled.dsimb") == unlabelled
+        arrays = binary.read(tmp_path / "unlabelled.dsimb")
+        assert binary.components(arrays)[0].label == model.Output((0, 0)).label == "output"
+        assert binary.terminals(arrays) == [("Output", "output")]
+
+        arrays = binary.read(path)
+        assert isinstance(arrays["drawables.pos"].base, np.memmap)
+        assert arrays["drawables.pos"].ctypes.data % binary.ALIGNMENT == 0
+        assert arrays["drawables.type"].tolist() == [0, 5, 5, 7, 8, 8, 8, 4, 6, 8]
+        assert arrays["drawables.inputs"][7] == 4
+        assert binary.load_netlist(path) is None
+
+        empty = tmp_path / "empty.dsimb"
+        binary.save(empty, {"drawables": [], "library": []})
+        assert binary.load(empty) == {"drawables": [], "library": []}
+
+    def test_components(self, circuit, tmp_path):
+        path = tmp_path / "circuit.dsimb"
+        binary.save(path, circuit)
+        arrays = binary.read(path)
+        built = binary.components(arrays)
+        expected = model.load(circuit)
+        assert [type(c) for c in built] == [type(c) for c in expected]
+        assert [c.parameters() for c in built] == [c.parameters() for c in expected]
+        assert [type(c) for c in binary.components(arrays, "library")] == [model.Input, model.XorGate]
+        assert binary.terminals(arrays) == [
+            ("Input", "a"), ("Input", "b"), ("Output", "y"), ("Clock", "clock")
+        ]
+
+    def test_version(self, circuit, tmp_path):
+        path = tmp_path / "circuit.dsimb"
+        binary.save(path, circuit)
+        data = bytearray(path.read_bytes())
+        data[8] = binary.VERSION + 1
+        path.write_bytes(bytes(data))
+        with pytest.raises(ValueError):
+            binary.read(path)
+        path.write_text(json.dumps(circuit))
+        with pytest.raises(ValueError):
+            binary.read(path)
+
+    def test_convert_and_run(self, circuit, tmp_path, capsys):
+        source = tmp_path / "circuit.dsim"
+        source.write_text(json.dumps(circuit, indent=4))
+        for netlist in ([], ["--netlist"]):
+            target = tmp_path / "circuit.dsimb"
+            assert binary.main([str(source), str(target)] + netlist) == 0
+            assert (binary.load_netlist(target) is None) == (not netlist)
+            assert (binary.decode_netlist(binary.read(target)) is None) == (not netlist)
+            back = tmp_path / "back.dsim"
+            assert binary.main([str(target), str(back)]) == 0
+            assert json.loads(back.read_text()) == circuit
+
+            assert main([str(target), "--set", "a=1", "--set", "b=1", "--print", "all"]) == 0
+            assert capsys.readouterr().out == "a=1\nb=1\ny=1\nclock=0\n"
+            assert main([str(target), "--set", "a=1"]) == 0
+            assert capsys.readouterr().out == "y=0\n"
@@ -3,6 +3,8 @@ import pygame
 import pygame.locals
 import pygame_gui
 from simulator.display import Display
+from simulator.component import AndGate, Line, Output
+from simulator.connections import Connections
 
 class TestDisplay:
 
@@ -35,6 +37,50 @@ class TestDisplay:
             self.post_and_next_frame(quit, generator)
         assert display.mode == "Quit"
     
+    def test_simulate_while_dragging(self):
+        display = Display(title="test")
+        gate, output = AndGate((200, 300)), Output((400, 300))
+        display.drawables = [gate, output]
+        generator = display.edit()
+        next(generator)
+        assert display.connections.overlapping(gate, 0) == set()
+        # the output is dragged onto the output of the gate, and the simulation starts before it is dropped
+        press = pygame.Event(pygame.MOUSEBUTTONDOWN, {"pos": (400, 300), "button": 1, "touch": False, "window": None})
+        move = pygame.Event(pygame.MOUSEMOTION, {"pos": (260, 300), "rel": (-140, 0), "buttons": (1, 0, 0), "touch": False, "window": None})
+        start = pygame.Event(pygame.KEYUP, {"key": pygame.locals.K_s, "mod": 0, "unicode": "s", "scancode": 0, "window": None})
+        self.post_and_next_frame(press, generator)
+        self.post_and_next_frame(move, generator)
+        with pytest.raises(StopIteration):
+            self.post_and_next_frame(start, generator)
+        assert display.mode == "Start simulation"
+        generator = display.simulate()
+        next(generator)
+        assert display.connections.overlapping(gate, 0) == {(output, 0)}
+        assert display.connections.neighbours == Connections(display.drawables).neighbours
+        display.quit()
+
+    def test_redraw_changed(self):
+        display = Display(title="test")
+        display.drawables = [AndGate((200, 300)), Line((230, 300), (280, 300)), Output((400, 300))]
+        background = display.create_background()
+        rects = [d.rect() for d in display.drawables]
+        # the background has everything in the off state
+        assert background.get_at((235, 300)) == pygame.Color("black")
+        assert background.get_at((100, 100)) == pygame.Color("white")
+        display.screen.fill("grey")
+        display.drawables[0].state = display.drawables[1].state = True
+        dirty = display.redraw_changed([display.drawables[0]], rects, background)
+        assert dirty == [rects[0]]
+        # the line that overlaps the gate is on and drawn on top of it, but only inside the rect of the gate
+        assert display.screen.get_at((235, 300)) == pygame.Color("green")
+        assert display.screen.get_at((270, 300)) == pygame.Color("grey")
+        assert display.redraw_changed([], rects, background) == []
+        # a full redraw is the background with the drawables that are on
+        display.redraw_simulation(background)
+        assert display.screen.get_at((270, 300)) == pygame.Color("green")
+        assert display.screen.get_at((100, 100)) == pygame.Color("white")
+        display.quit()
+
     @pytest.mark.timeout(3)
     def test_open_fileopen_dialog(self):
         display = Display(title="test")
@@ -1,7 +1,24 @@
 import json
 import pygame
+import pytest
 
-from simulator.component import AndGate, NandGate, Input, Output, Line, ComponentEncoder
+from simulator import model
+from simulator.spatial import AppendOnlyIndex, SpatialIndex
+from simulator.component import (
+    AndGate,
+    NandGate,
+    OrGate,
+    NorGate,
+    XorGate,
+    Input,
+    Clock,
+    Output,
+    Line,
+    ComponentEncoder,
+    ComponentDecoder,
+    ConnectorOverlay,
+    icon,
+)
 
 
 class TestDrawables:
@@ -67,6 +84,178 @@ class TestDrawables:
         s = json.dumps([AndGate(pos),pos,Line(pos,pos2)], cls=ComponentEncoder, indent=None)
         assert s == '[{"type": "AndGate", "dict": {"pos": [100.0, 100.0], "angle": 0, "label": "and"}}, [100.0, 100.0], {"type": "Line", "dict": {"start": [100.0, 100.0], "end": [200.0, 100.0], "angle": 0, "label": ""}}]'
 
+    def test_wide_gates(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        pos = pygame.math.Vector2(100, 100)
+        for gate in (AndGate, NandGate, OrGate, NorGate, XorGate):
+            assert gate(pos).surface.get_size() == (80, 60)
+            wide = gate(pos, inputs=4)
+            assert wide.surface.get_size() == (80, 100)
+            assert [hotspot.direction for hotspot in wide.connectors] == ["output"] + ["input"] * 4
+            assert [hotspot.position for hotspot in wide.connectors[1:]] == [
+                (-40, -30), (-40, -10), (-40, 10), (-40, 30)
+            ]
+
+        s = json.dumps({"drawables": [OrGate(pos, inputs=3)], "library": []}, cls=ComponentEncoder)
+        assert '"inputs": 3' in s
+        gate = ComponentDecoder(json.loads(s)).d_objs[0]
+        assert type(gate) == OrGate
+        assert gate.inputs == 3
+
+    def test_clock(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        pos = pygame.math.Vector2(100, 100)
+        clock = Clock(pos, period=8, phase=3)
+        assert [hotspot.direction for hotspot in clock.connectors] == ["output"]
+        assert not hasattr(clock, "toggle")  # driven by the simulation time, not by clicks
+
+        s = json.dumps({"drawables": [clock], "library": []}, cls=ComponentEncoder)
+        clock = ComponentDecoder(json.loads(s)).d_objs[0]
+        assert type(clock) == Clock
+        assert (clock.period, clock.phase) == (8, 3)
+
+    def test_model_geometry(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        # the pygame free models must have exactly the same hotspots as the drawables
+        pos = (100, 101)
+        pairs = [
+            (AndGate(pos), model.AndGate(pos)),
+            (NandGate(pos, inputs=5), model.NandGate(pos, inputs=5)),
+            (XorGate(pos, size=(90, 70)), model.XorGate(pos, size=(90, 70))),
+            (Input(pos), model.Input(pos)),
+            (Clock(pos), model.Clock(pos)),
+            (Output(pos), model.Output(pos)),
+            (Line((10, 20), (53, 20)), model.Line((10, 20), (53, 20))),
+            (Line((53, 21), (10, 20)), model.Line((53, 21), (10, 20))),
+            (Line((10, 20), (10, 75)), model.Line((10, 20), (10, 75))),
+            (Line((15, 75), (10, 20)), model.Line((15, 75), (10, 20))),
+        ]
+        for drawable, component in pairs:
+            assert isinstance(drawable, type(component))
+            assert tuple(drawable.pos) == tuple(component.pos)
+            assert [(tuple(h.position), h.radius, h.direction) for h in drawable.connectors] == [
+                (tuple(h.position), h.radius, h.direction) for h in component.connectors
+            ]
+
+    def test_rotated_geometry(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        pos = (100, 101)
+        for angle in (90, 180, 270):
+            pairs = [
+                (AndGate(pos, angle), model.AndGate(pos, angle)),
+                (NandGate(pos, angle, inputs=5), model.NandGate(pos, angle, inputs=5)),
+                (Input(pos, angle), model.Input(pos, angle)),
+                (Output(pos, angle), model.Output(pos, angle)),
+            ]
+            for drawable, component in pairs:
+                # created rotated or rotated afterwards gives the same result
+                if isinstance(drawable, model.Gate):
+                    rotated = type(drawable)(pos, inputs=drawable.inputs)
+                else:
+                    rotated = type(drawable)(pos)
+                for _ in range(angle // 90):
+                    rotated.rotate(90)
+                assert rotated.angle == drawable.angle == angle
+                assert rotated.connectors is drawable.connectors
+                assert rotated.surface is drawable.surface and rotated.overlay is drawable.overlay
+                assert [(tuple(h.position), h.direction) for h in drawable.connectors] == [
+                    (tuple(h.position), h.direction) for h in component.connectors
+                ]
+
+    def test_orientations(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        pos = pygame.math.Vector2(100, 100)
+        a, b = Input(pos), Input(pos + (50, 0))
+        # rotating only selects one of the four shared orientations
+        assert a.orientations is b.orientations and len(a.orientations) == 4
+        a.rotate(90)
+        assert a.orientation == 1 and a.connectors is not b.connectors
+        assert a.surface.get_size() == (40, 40)
+        click = a.pos + a.connectors[0].position
+        assert a.collideconnector(click) == (True, click)
+        for _ in range(3):
+            a.rotate(90)
+        assert a.angle == 0
+        assert a.connectors is b.connectors and a.overlay is b.overlay
+        # vertical lines are horizontal lines turned a quarter
+        line = Line((0, 0), (0, 50))
+        assert line.orientation == 1 and line.orientations is Line((10, 0), (60, 0)).orientations
+
+        # the key and the surfaces of the orientations must come from a subclass
+        class Shapeless(ConnectorOverlay):
+            def surfaces(self, quarter):
+                return a.surfaces(quarter)
+
+        with pytest.raises(TypeError):
+            Shapeless(pos)
+
+    def test_decoder_models(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        pos = pygame.math.Vector2(100, 100)
+        drawables = [AndGate(pos), OrGate(pos, inputs=3), Input(pos), Clock(pos, period=4), Output(pos), Line((0, 0), (0, 50))]
+        s = json.dumps({"drawables": drawables, "library": [Input(pos)]}, cls=ComponentEncoder)
+        cd = ComponentDecoder(json.loads(s))
+        # decoding creates only the lightweight models, without any surfaces
+        assert "d_objs" not in vars(cd)
+        assert [type(m) for m in cd.models] == [
+            model.AndGate, model.OrGate, model.Input, model.Clock, model.Output, model.Line
+        ]
+        assert not any(hasattr(m, "__dict__") or hasattr(m, "surface") for m in cd.models)
+        assert cd.models[0].connectors is model.AndGate((0, 0)).connectors
+        # the models save exactly like the drawables
+        assert json.dumps({"drawables": cd.models, "library": cd.library_models}, cls=ComponentEncoder) == s
+        # and the drawables are created when they are needed
+        assert [type(d) for d in cd.d_objs] == [type(d) for d in drawables]
+        assert cd.d_objs is cd.d_objs
+        assert type(cd.l_objs[0]) == Input
+
+    def test_icon_cache(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        pos = pygame.math.Vector2(100, 100)
+        a, b = AndGate(pos), AndGate(pos)
+        # the icons are shared, not copied
+        assert a.surface is b.surface and a.surface_on is b.surface_on
+        assert AndGate(pos, inputs=3).surface is not a.surface
+        a.rotate(90)
+        a.rotate(90)
+        b.rotate(180)
+        assert a.surface is b.surface is icon("icons/80x60/AND_OFF.svg", (80, 60), 180)
+        assert a.surface.get_size() == (80, 60)
+        a.rotate(180)
+        assert a.surface is AndGate(pos).surface
+
+    def test_spatial_index(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        def scan(drawables, pos):
+            # the first drawable hit by a full scan, connectors before the body, like Display.edit
+            for d in drawables:
+                if d.collideconnector(pos)[0] or d.collidepoint(pos):
+                    return d
+
+        def first(index, pos):
+            for d in index.at(pos):
+                if d.collideconnector(pos)[0] or d.collidepoint(pos):
+                    return d
+
+        drawables = [AndGate((x, y)) for x in range(100, 700, 70) for y in range(100, 500, 50)]
+        drawables += [Input((95, 300)), Line((100, 100), (100, 400)), Output((640, 130))]
+        index = SpatialIndex(drawables, cell=50)
+        points = [(x, y) for x in range(40, 760, 7) for y in range(40, 560, 11)]
+        assert all(first(index, p) is scan(drawables, p) for p in points)
+        assert max(len(cell) for cell in index.cells.values()) < 10
+
+        # moved, rotated and appended drawables are found at their new place
+        drawables[0].pos = pygame.math.Vector2(400, 520)
+        index.move(drawables[0])
+        drawables[1].rotate(90)
+        index.move(drawables[1])
+        drawables.append(XorGate((300, 540)))
+        assert all(first(index, p) is scan(drawables, p) for p in points)
+        assert first(index, (400, 520)) is drawables[0]
+        # a new list starts over
+        del drawables[:]
+        assert index.at((400, 520)) == []
+
+        # an index that cannot enter items cannot be created
+        class Unordered(AppendOnlyIndex):
+            def clear(self):
+                self.cells = {}
+
+        with pytest.raises(TypeError):
+            Unordered(drawables)
+
     def test_collidepoint_andgate(self, _init_pygame, default_ui_manager, _display_surface_return_none):
         pos = pygame.math.Vector2(100, 100)
         pos2 = pygame.math.Vector2(200, 100)
@@ -0,0 +1,77 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from simulator.component import AndGate, NandGate, Input, Output, Line, ComponentEncoder
+from simulator.run import main
+
+
+class TestRun:
+    @pytest.fixture()
+    def and_gate_file(self, tmp_path, _init_pygame, default_ui_manager, _display_surface_return_none):
+        drawables = [
+            AndGate((200, 300)),
+            Input((100, 290), label="a"),
+            Input((100, 310), label="b"),
+            Output((300, 300), label="y"),
+            Line((120, 290), (160, 290)),
+            Line((120, 310), (160, 310)),
+            Line((240, 300), (280, 300)),
+        ]
+        path = tmp_path / "and.dsim"
+        path.write_text(json.dumps({"drawables": drawables, "library": []}, cls=ComponentEncoder))
+        return path
+
+    def test_run(self, and_gate_file, capsys):
+        assert main([str(and_gate_file), "--set", "a=1"]) == 0
+        assert capsys.readouterr().out == "y=0\n"
+        assert main([str(and_gate_file), "--set", "a=1", "--set", "b=1", "--print", "all"]) == 0
+        assert capsys.readouterr().out == "a=1\nb=1\ny=1\n"
+        with pytest.raises(SystemExit):
+            main([str(and_gate_file), "--set", "c=1"])
+
+    def test_run_oscillator(self, tmp_path, capsys, _init_pygame, default_ui_manager, _display_surface_return_none):
+        # a nand gate that feeds its own output back to both inputs never settles, whatever the engine
+        drawables = [
+            NandGate((200, 300)),
+            Output((300, 300), label="y"),
+            Line((240, 300), (280, 300)),
+            Line((240, 300), (240, 330)),
+            Line((240, 330), (140, 330)),
+            Line((140, 330), (140, 310)),
+            Line((140, 310), (160, 310)),
+            Line((140, 310), (140, 290)),
+            Line((140, 290), (160, 290)),
+        ]
+        path = tmp_path / "osc.dsim"
+        path.write_text(json.dumps({"drawables": drawables, "library": []}, cls=ComponentEncoder))
+        for engine in ("sync", "event", "levelized"):
+            assert main([str(path), "--engine", engine]) == 1
+            assert "did not settle" in capsys.readouterr().err
+
+    def test_run_cache(self, and_gate_file, tmp_path, capsys):
+        cache = tmp_path / "cache"
+        for _ in range(2):
+            assert main([str(and_gate_file), "--set", "a=1", "--set", "b=1", "--cache", str(cache)]) == 0
+            assert capsys.readouterr().out == "y=1\n"
+            assert len(list(cache.iterdir())) == 1
+
+    def test_run_without_pygame(self, and_gate_file):
+        # a fresh interpreter must be able to simulate the file without ever importing pygame
+        script = (
+            "import sys\n"
+            "from simulator.run import main\n"
+            f"main([{str(and_gate_file)!r}, '--set', 'a=1', '--set', 'b=1'])\n"
+            "assert 'pygame' not in sys.modules\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=Path(__file__).parent.parent,
+            capture_output=True,
+            text=True,
+        )
+        assert result.returncode == 0, result.stderr
+        assert result.stdout == "y=1\n"
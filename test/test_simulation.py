@@ -1,12 +1,45 @@
+import copy
+import os
 import json
+import pickle
 import pytest
 
 import numpy as np
 
 import pygame
 
-from simulator.component import AndGate, ComponentDecoder, NandGate, Input, Output, Line
-from simulator.simulation import Simulation
+from simulator.component import (
+    AndGate,
+    ComponentDecoder,
+    NandGate,
+    OrGate,
+    NorGate,
+    XorGate,
+    Input,
+    Clock,
+    Output,
+    Line,
+)
+from simulator.simulation import Simulation, csr_ranges, pack_patterns, unpack_patterns
+import simulator.backends
+import simulator.connections
+from simulator.backends import backends
+from simulator.parallel import ShardedSimulation, partition
+from simulator.faults import simulate_faults, all_faults, STUCK_AT
+from simulator.connections import Connections
+import simulator.cache
+import simulator.faults
+from simulator.cache import NetlistCache, geometry_key
+from simulator.simulation import Netlist
+from simulator import model
+
+
+@pytest.fixture(autouse=True, params=sorted(backends))
+def backend(request, monkeypatch):
+    # run every test against every available backend
+    monkeypatch.setattr(simulator.backends, "default_backend", lambda: request.param)
+    return request.param
+
 
 single_and_gate = """
 {
@@ -423,6 +456,930 @@ class TestSimulation:
         assert all([s.state == o for s, o in zip(
             components, simulation.output)])
 
+    @staticmethod
+    def chain_of_gates(n):
+        # a chain of gates where the output of each gate overlaps the first input of the next one.
+        # copying a single gate avoids loading the same icons thousands of times
+        template = AndGate((0, 0))
+        components = []
+        for i in range(n):
+            gate = copy.copy(template)
+            gate.pos = pygame.math.Vector2(80 * (i % 100), 10 * i)
+            components.append(gate)
+        return components
+
+    @staticmethod
+    def random_circuit(n_inputs, n_gates, seed=0):
+        # a random acyclic circuit of and and nand gates; the arrays are filled in directly instead of by connect()
+        rng = np.random.default_rng(seed)
+        templates = (Input((0, 0)), AndGate((0, 0)), NandGate((0, 0)))
+        components = [copy.copy(templates[0]) for i in range(n_inputs)]
+        components += [copy.copy(templates[rng.integers(1, 3)]) for i in range(n_gates)]
+        components.append(copy.copy(Output((0, 0))))
+        simulation = Simulation(components)
+        for index, component in enumerate(components):
+            simulation.operation[index] = simulation.functionsmap[type(component)]
+            if index < n_inputs:
+                simulation.inputmap1[index] = simulation.inputmap2[index] = index
+            else:
+                simulation.inputmap1[index] = rng.integers(0, index)
+                simulation.inputmap2[index] = rng.integers(0, index)
+        simulation.inputmap1[-2] = simulation.inputmap2[-2] = len(components) - 2
+        simulation.input_index = np.arange(n_inputs, dtype=np.int32)
+        simulation.output_index = np.array([len(components) - 1], dtype=np.int32)
+        simulation._build_indices()
+        return simulation
+
+    def test_pack_patterns(self):
+        patterns = np.random.default_rng(1).integers(0, 2, (40, 5)).astype(bool)
+        words = pack_patterns(patterns)
+        assert words.dtype == np.uint64
+        assert words.shape == (5,)
+        assert int(words[0]) == sum(int(p) << i for i, p in enumerate(patterns[:, 0]))
+        assert np.all(unpack_patterns(words, 40) == patterns)
+        with pytest.raises(ValueError):
+            pack_patterns(np.zeros((65, 1)))
+
+    def test_settle_packed(
+        self, _init_pygame, default_ui_manager, _display_surface_return_none
+    ):
+        simulation = self.random_circuit(6, 200)
+        # all 64 combinations of 6 inputs in a single pass
+        patterns = (np.arange(64)[:, np.newaxis] >> np.arange(6)) & 1
+        words = simulation.settle_packed(pack_patterns(patterns))
+        packed_result = unpack_patterns(words)
+
+        for lane, pattern in enumerate(patterns):
+            for component, value in zip(simulation.components, pattern):
+                component.state = bool(value)
+            simulation.update_inputs()
+            simulation.settle()
+            assert np.all(packed_result[lane] == simulation.output)
+
+    def test_csr_ranges(self):
+        # rows [10, 11], [], [12, 13, 14]
+        ptr = np.array([0, 2, 2, 5], dtype=np.int32)
+        positions, segments = csr_ranges(ptr, np.array([2, 0, 1, 2]))
+        assert positions.tolist() == [2, 3, 4, 0, 1, 2, 3, 4]
+        assert segments.tolist() == [0, 3, 5, 5]
+        positions, segments = csr_ranges(ptr, np.array([], dtype=np.int32))
+        assert positions.size == segments.size == 0
+
+    def test_fanout(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        simulation = self.random_circuit(4, 50)
+        for element in range(simulation.n):
+            expected = np.flatnonzero(
+                (simulation.inputmap1 == element) | (simulation.inputmap2 == element)
+            )
+            fanout = simulation.fanout[simulation.fanout_ptr[element]:simulation.fanout_ptr[element + 1]]
+            assert np.all(np.sort(fanout) == expected)
+        assert np.all(simulation._fanout_of(np.array([0, 1])) == np.union1d(
+            simulation._fanout_of(np.array([0])), simulation._fanout_of(np.array([1]))
+        ))
+
+    def test_event_engine(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        sync = self.random_circuit(8, 300, seed=3)
+        event = self.random_circuit(8, 300, seed=3)
+        event.engine = "event"
+        rng = np.random.default_rng(5)
+        for i in range(20):
+            toggle = rng.integers(0, 8)
+            for simulation in (sync, event):
+                simulation.components[toggle].toggle()
+                simulation.update_inputs()
+            assert event.settle() == sync.settle()
+            assert np.all(event.output == sync.output)
+            assert np.all(event.input1 == sync.input1)
+            assert np.all(event.input2 == sync.input2)
+
+    def test_event_engine_bounded(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        components = [Input((100, 100)), Line((120, 100), (200, 100)), Output((220, 100))]
+        simulation = Simulation(components, engine="event")
+        simulation.connect()
+        simulation.settle()
+        components[0].state = True
+        simulation.update_inputs()
+        assert simulation.settle(2) == 2
+        assert np.all(simulation.output == [1, 1, 0, 0])
+        # the remaining work is picked up by the next call
+        assert simulation.settle() == 2
+        assert np.all(simulation.output == [1, 1, 1, 0])
+        with pytest.raises(ValueError):
+            Simulation(components, engine="magic")
+
+    def test_levels(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        simulation = self.random_circuit(4, 100)
+        level_of = np.zeros(simulation.n, dtype=int)
+        for level, elements in enumerate(simulation.levels):
+            level_of[elements] = level
+        assert sorted(np.concatenate(simulation.levels)) == list(range(simulation.n))
+        assert np.all(level_of[:4] == 0)
+        gates = np.arange(4, simulation.n - 1)
+        assert np.all(level_of[simulation.inputmap1[gates]] < level_of[gates])
+        assert np.all(level_of[simulation.inputmap2[gates]] < level_of[gates])
+
+    def test_levelized_engine(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        sync = self.random_circuit(8, 300, seed=7)
+        levelized = self.random_circuit(8, 300, seed=7)
+        levelized.engine = "levelized"
+        rng = np.random.default_rng(9)
+        for i in range(10):
+            toggle = rng.integers(0, 8)
+            for simulation in (sync, levelized):
+                simulation.components[toggle].toggle()
+                simulation.update_inputs()
+            sync.settle()
+            # always a single sweep
+            assert levelized.settle() == 1
+            assert np.all(levelized.output == sync.output)
+            assert not levelized.simulate_np()
+
+    def test_levelized_engine_feedback(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        sync = self.random_circuit(8, 100, seed=11)
+        levelized = self.random_circuit(8, 100, seed=11)
+        levelized.engine = "levelized"
+        for simulation in (sync, levelized):
+            # create a loop between two gates
+            simulation.inputmap1[50] = 60
+            simulation.inputmap1[60] = 50
+            simulation._build_indices()
+            simulation.components[0].toggle()
+            simulation.update_inputs()
+        assert levelized.levels is None
+        assert levelized.settle(50) == sync.settle(50)
+        assert np.all(levelized.output == sync.output)
+
+    @staticmethod
+    def ring(simulation, elements):
+        # connect the elements in a ring, each reading both inputs from the previous one
+        for previous, element in zip(np.roll(elements, 1), elements):
+            simulation.inputmap1[element] = simulation.inputmap2[element] = previous
+        simulation._build_indices()
+
+    def test_cycles(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        simulation = self.random_circuit(4, 100)
+        assert simulation.cycles == []
+        self.ring(simulation, [10, 20, 30])
+        self.ring(simulation, [50, 60])
+        # a gate that reads its own output on one input
+        simulation.inputmap1[70] = 70
+        simulation._build_indices()
+        assert sorted(cycle.tolist() for cycle in simulation.cycles) == [[10, 20, 30], [50, 60], [70]]
+        assert simulation.levels is None
+
+    @staticmethod
+    def nand_oscillator():
+        # a nand gate whose output is wired back to both of its inputs
+        return [
+            NandGate((200, 300)),
+            Output((300, 300)),
+            Line((240, 300), (280, 300)),
+            Line((240, 300), (240, 330)),
+            Line((240, 330), (140, 330)),
+            Line((140, 330), (140, 310)),
+            Line((140, 310), (160, 310)),
+            Line((140, 310), (140, 290)),
+            Line((140, 290), (160, 290)),
+        ]
+
+    @pytest.mark.parametrize("engine", ("sync", "event", "levelized"))
+    def test_self_oscillator_collapsed(self, _init_pygame, default_ui_manager, _display_surface_return_none, engine):
+        # after collapsing, the gate reads its own output on both inputs, which is feedback and not an input
+        simulation = Simulation(self.nand_oscillator(), engine=engine, collapse=True)
+        simulation.connect()
+        assert simulation.inputmap1[0] == simulation.inputmap2[0] == 0
+        assert simulation.levels is None
+        simulation.update_inputs()
+        simulation.settle(100)
+        assert not simulation.settled
+
+    def test_self_oscillator_cycles(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        for collapse in (False, True):
+            simulation = Simulation(self.nand_oscillator(), collapse=collapse)
+            simulation.connect()
+            if collapse:
+                # only the gate is left, reading itself
+                assert [cycle.tolist() for cycle in simulation.cycles] == [[0]]
+            else:
+                # the gate and the lines that feed its output back to its inputs
+                assert len(simulation.cycles) == 1
+                assert 0 in simulation.cycles[0].tolist() and len(simulation.cycles[0]) > 1
+
+    def test_find_oscillation(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        simulation = self.random_circuit(4, 100)
+        simulation.update_inputs()
+        assert simulation.find_oscillation() is None
+        assert simulation.settled
+
+        # a ring of three inverting gates
+        simulation = self.random_circuit(4, 100)
+        inverters = [i for i in range(4, 100) if type(simulation.components[i]) == NandGate][:3]
+        self.ring(simulation, inverters)
+        simulation.update_inputs()
+        assert simulation.settle(1000) == 1000
+        assert not simulation.settled
+        period, elements = simulation.find_oscillation()
+        assert period == 2
+        assert set(inverters) <= set(elements)
+        assert not simulation.settled
+
+    def test_run_batch(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        acyclic = self.random_circuit(5, 150, seed=13)
+        feedback = self.random_circuit(5, 150, seed=13)
+        feedback.inputmap1[100] = 120
+        feedback.inputmap1[120] = 100
+        feedback._build_indices()
+        assert feedback.levels is None
+        # all 32 combinations of 5 inputs
+        stimuli = ((np.arange(32)[:, np.newaxis] >> np.arange(5)) & 1).astype(bool)
+        for simulation in (acyclic, feedback):
+            outputs = simulation.run_batch(stimuli)
+            assert outputs.shape == (32, 1)
+            for row, stimulus in enumerate(stimuli):
+                for component, value in zip(simulation.components, stimulus):
+                    component.state = bool(value)
+                simulation.update_inputs()
+                simulation.settle()
+                assert outputs[row, 0] == simulation.output[simulation.output_index[0]]
+        with pytest.raises(ValueError):
+            acyclic.run_batch(np.zeros((3, 4)))
+
+    def test_run_batch_and_gate(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        simulation = Simulation(self.and_gate_circuit(), collapse=True)
+        simulation.connect()
+        outputs = simulation.run_batch([[0, 0], [0, 1], [1, 0], [1, 1]])
+        assert np.all(outputs == [[0], [0], [0], [1]])
+
+    @staticmethod
+    def wide_gate_circuit(gate, inputs):
+        # a gate at (200, 300) with an Input touching each of its input connectors and an Output
+        components = [gate((200, 300), inputs=inputs)]
+        height = 20 * (inputs + 1)
+        components += [
+            Input((140, 300 - height // 2 + (i + 1) * height // (inputs + 1)))
+            for i in range(inputs)
+        ]
+        components += [Line((240, 300), (280, 300)), Output((300, 300))]
+        return components
+
+    @pytest.mark.parametrize(
+        "gate, function",
+        (
+            (AndGate, np.all),
+            (NandGate, lambda v, axis: ~np.all(v, axis=axis)),
+            (OrGate, np.any),
+            (NorGate, lambda v, axis: ~np.any(v, axis=axis)),
+            (XorGate, lambda v, axis: np.sum(v, axis=axis) % 2 == 1),
+        ),
+    )
+    @pytest.mark.parametrize("inputs", (2, 3, 5))
+    def test_gates(
+        self, _init_pygame, default_ui_manager, _display_surface_return_none, gate, function, inputs
+    ):
+        stimuli = ((np.arange(2**inputs)[:, np.newaxis] >> np.arange(inputs)) & 1).astype(bool)
+        expected = function(stimuli, axis=1)
+
+        simulation = Simulation(self.wide_gate_circuit(gate, inputs))
+        simulation.connect()
+        assert len(simulation.wide) == (inputs > 2)
+        assert np.all(simulation.run_batch(stimuli)[:, 0] == expected)
+        words = simulation.settle_packed(pack_patterns(stimuli))
+        assert np.all(unpack_patterns(words, len(stimuli))[:, simulation.output_index[0]] == expected)
+
+        for engine in ("sync", "event", "levelized"):
+            for collapse in (False, True):
+                components = self.wide_gate_circuit(gate, inputs)
+                simulation = Simulation(components, engine=engine, collapse=collapse)
+                simulation.connect()
+                for stimulus, value in zip(stimuli, expected):
+                    for component, state in zip(components[1:], stimulus):
+                        component.state = bool(state)
+                    simulation.update_inputs()
+                    simulation.settle()
+                    simulation.update_components()
+                    assert components[-1].state == value
+
+    def test_wide_gate_unconnected(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        # an unconnected input reads False
+        components = self.wide_gate_circuit(NorGate, 4)
+        del components[1]
+        simulation = Simulation(components)
+        simulation.connect()
+        assert np.all(simulation.wide_inputs == [1, 2, 3, simulation.n - 1])
+        assert np.all(simulation.run_batch([[0, 0, 0], [0, 1, 0]]) == [[1], [0]])
+
+    def test_connect_matches_full_scan(
+        self, _init_pygame, default_ui_manager, _display_surface_return_none
+    ):
+        rng = np.random.default_rng(42)
+        components = [
+            t((x, y))
+            for t, x, y in zip(
+                (AndGate, NandGate, Input) * 33,
+                rng.integers(0, 400, 99),
+                rng.integers(0, 400, 99),
+            )
+        ]
+        simulation = Simulation(components)
+        simulation.connect()
+
+        # reference: compare every input hotspot with every output hotspot of every other component
+        for component in components:
+            expected = []
+            for connector in component.connectors:
+                if connector.direction == "input":
+                    for other_index, other in enumerate(components):
+                        if other is not component:
+                            for other_connector in other.connectors:
+                                if other_connector.direction in (
+                                    "output",
+                                    "bidirectional",
+                                ) and Simulation.overlap(
+                                    component, connector, other, other_connector
+                                ):
+                                    expected.append(other_index)
+            assert component.inputmap == expected
+        assert any(component.inputmap for component in components)
+
+    def test_connect_chain(
+        self, _init_pygame, default_ui_manager, _display_surface_return_none
+    ):
+        components = self.chain_of_gates(250)
+        simulation = Simulation(components)
+        simulation.connect()
+        # the chain wraps around every 100 gates
+        for i, component in enumerate(components):
+            assert component.inputmap == ([] if i % 100 == 0 else [i - 1])
+
+    def test_long_wire(
+        self, _init_pygame, default_ui_manager, _display_surface_return_none
+    ):
+        # an input, followed by 200 short line segments and an output
+        components = [Input((100, 100))]
+        x = 120
+        for i in range(200):
+            components.append(Line((x, 100), (x + 20, 100)))
+            x += 20
+        components.append(Output((x + 20, 100)))
+        simulation = Simulation(components)
+        simulation.connect()
+        assert all(line.inputmap == [0] for line in components[1:-1])
+        assert components[-1].inputmap == [200]
+
+        components[0].state = True
+        simulation.update_inputs()
+        while simulation.simulate_np():
+            pass
+        assert np.all(simulation.output[:-1])
+
+    def test_wire_loop(
+        self, _init_pygame, default_ui_manager, _display_surface_return_none
+    ):
+        # a square of lines with a stub that is driven by an input
+        components = [
+            Line((200, 100), (300, 100)),
+            Line((300, 100), (300, 200)),
+            Line((300, 200), (200, 200)),
+            Line((200, 200), (200, 100)),
+            Line((140, 100), (200, 100)),
+            Input((120, 100)),
+            # a separate line that is not driven by anything
+            Line((500, 100), (600, 100)),
+        ]
+        simulation = Simulation(components)
+        simulation.connect()
+        assert all(line.inputmap == [5] for line in components[:5])
+        assert components[6].inputmap == []
+        assert simulation.inputmap1[6] == simulation.n - 1
+
+    @staticmethod
+    def and_gate_circuit():
+        # two inputs and an output connected to an and gate with lines
+        return [
+            AndGate((200, 300)),
+            Input((100, 290)),
+            Input((100, 310)),
+            Output((300, 300)),
+            Line((120, 290), (160, 290)),
+            Line((120, 310), (140, 310)),
+            Line((140, 310), (160, 310)),
+            Line((240, 300), (280, 300)),
+        ]
+
+    def test_connections(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        def arrays(components, connections=None):
+            simulation = Simulation(components, connections=connections)
+            simulation.connect()
+            return simulation.inputmap1.tolist(), simulation.inputmap2.tolist()
+
+        components = self.and_gate_circuit()
+        connections = Connections(components)
+        assert arrays(components, connections) == arrays(components)
+        # the and gate only overlaps the lines at its inputs and output
+        assert {c for c, _ in connections.overlapping(components[0], 0)} == {components[7]}
+
+        # move the gate away and back again, rotate an input and add a line: only the touched components are updated
+        edits = [
+            lambda: setattr(components[0], "pos", pygame.math.Vector2(500, 500)),
+            lambda: setattr(components[0], "pos", pygame.math.Vector2(200, 300)),
+            lambda: components[1].rotate(90),
+            lambda: components[1].rotate(270),
+        ]
+        for edit in edits:
+            edit()
+            connections.update(components[0] if edit in edits[:2] else components[1])
+            assert arrays(components, connections) == arrays(components)
+        components += [Input((100, 400)), Line((120, 400), (160, 400)), Output((180, 400))]
+        assert arrays(components, connections) == arrays(components)
+        assert arrays(components, connections)[0][-4:-1] == [8, 8, 9]
+        # a new list starts over
+        del components[4:]
+        assert arrays(components, connections) == arrays(components)
+
+        # the ends of a short line overlap each other, but a component is never connected to itself
+        short = Line((600, 600), (604, 600))
+        assert not Connections([short]).overlapping(short, 0)
+
+    def test_netlist_cache(
+        self, _init_pygame, default_ui_manager, _display_surface_return_none, tmp_path, monkeypatch
+    ):
+        cache = NetlistCache(tmp_path)
+        cold = Simulation(self.and_gate_circuit(), collapse=True, cache=cache)
+        cold.connect()
+        assert len(list(tmp_path.iterdir())) == 1
+
+        # a warm run does not connect at all, and drawables and models of the same circuit share the entry
+        def fail(self):
+            raise AssertionError("connected although the circuit is cached")
+
+        monkeypatch.setattr(Simulation, "_connect", fail)
+        models = [
+            model.build({"type": type(c).__name__, "dict": c.parameters()}) for c in self.and_gate_circuit()
+        ]
+        warm = Simulation(models, collapse=True, cache=cache)
+        warm.connect()
+        for name in Netlist.fields:
+            assert np.array_equal(getattr(warm, name), getattr(cold, name))
+        models[1].state = models[2].state = True
+        warm.update_inputs()
+        warm.settle()
+        warm.update_components()
+        assert models[3].state
+        monkeypatch.undo()
+
+        # any change to the geometry or to the version gives another key
+        components = self.and_gate_circuit()
+        key = geometry_key(components, True)
+        assert geometry_key(components, False) != key
+        components[1].rotate(90)
+        assert geometry_key(components, True) != key
+        monkeypatch.setattr(simulator.cache, "VERSION", simulator.cache.VERSION + 1)
+        assert geometry_key(self.and_gate_circuit(), True) != key
+        monkeypatch.undo()
+
+        # an unreadable entry is a miss
+        cache.path(key).write_bytes(b"garbage")
+        assert cache.get(key) is None
+
+        # the least recently used entries are removed first
+        small = NetlistCache(tmp_path / "small")
+        netlist = cold.netlist()
+        small.put("a", netlist)
+        small.max_bytes = 3 * small.path("a").stat().st_size
+        for index, name in enumerate("abc"):
+            small.put(name, netlist)
+            os.utime(small.path(name), (index, index))
+        assert small.get("a") is not None  # now the most recently used
+        small.put("d", netlist)
+        assert sorted(path.stem for path in small.directory.iterdir()) == ["a", "c", "d"]
+
+    def test_collapse(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        components = self.and_gate_circuit()
+        simulation = Simulation(components, collapse=True)
+        simulation.connect()
+        # only the gate, the inputs and the dummy element are left
+        assert simulation.n == 4
+        assert np.all(simulation.inputmap1 == [1, 1, 2, 3])
+        assert np.all(simulation.inputmap2 == [2, 1, 2, 3])
+        assert np.all(simulation.slot == [0, 1, 2, 0, 1, 2, 2, 0])
+        assert np.all(simulation.input_index == [1, 2])
+        assert np.all(simulation.output_index == [0])
+
+        components[1].state = components[2].state = True
+        simulation.update_inputs()
+        # inputs, gate and a final step without changes
+        assert simulation.settle() == 3
+        simulation.update_components()
+        assert all(component.state for component in components)
+
+    def test_update_components_changed(
+        self, _init_pygame, default_ui_manager, _display_surface_return_none
+    ):
+        components = self.and_gate_circuit()
+        simulation = Simulation(components, collapse=True)
+        simulation.connect()
+        components[1].state = True
+        simulation.update_inputs()
+        simulation.settle()
+        # only the components whose state changed are returned, the Input was already on
+        assert simulation.update_components() == [components[4]]
+        assert simulation.update_components() == []
+        components[2].state = True
+        simulation.update_inputs()
+        simulation.settle()
+        # Inputs are returned too, once their element follows
+        assert simulation.update_components() == [components[0], components[2], components[3], components[5], components[6], components[7]]
+        components[1].toggle()
+        simulation.update_inputs()
+        simulation.settle()
+        assert simulation.update_components() == [components[0], components[1], components[3], components[4], components[7]]
+        assert np.all(simulation.input_components == [1, 2])
+
+    def test_collapse_same_result(
+        self, _init_pygame, default_ui_manager, _display_surface_return_none
+    ):
+        full = self.and_gate_circuit()
+        collapsed = self.and_gate_circuit()
+        simulations = Simulation(full), Simulation(collapsed, collapse=True)
+        for simulation in simulations:
+            simulation.connect()
+        for a, b in ((0, 0), (1, 0), (0, 1), (1, 1), (0, 1)):
+            for simulation in simulations:
+                simulation.components[1].state = bool(a)
+                simulation.components[2].state = bool(b)
+                simulation.update_inputs()
+                simulation.settle()
+                simulation.update_components()
+            assert [c.state for c in full] == [c.state for c in collapsed]
+            assert full[3].state == bool(a and b)
+
+    def test_collapse_long_wire(
+        self, _init_pygame, default_ui_manager, _display_surface_return_none
+    ):
+        components = [Input((100, 100))]
+        components += [Line((x, 100), (x + 20, 100)) for x in range(120, 4120, 20)]
+        components.append(Output((4140, 100)))
+        # a loop of lines that is not driven
+        components += [
+            Line((200, 200), (300, 200)),
+            Line((300, 200), (300, 300)),
+            Line((300, 300), (200, 300)),
+            Line((200, 300), (200, 200)),
+        ]
+        simulation = Simulation(components, collapse=True)
+        simulation.connect()
+        assert simulation.n == 2
+        components[0].state = True
+        simulation.update_inputs()
+        assert simulation.settle() == 2
+        simulation.update_components()
+        assert all(component.state for component in components[:-4])
+        assert not any(component.state for component in components[-4:])
+
+    def test_settle(
+        self, _init_pygame, default_ui_manager, _display_surface_return_none
+    ):
+        components = [Input((100, 100)), Line((120, 100), (200, 100)), Output((220, 100))]
+        simulation = Simulation(components)
+        simulation.connect()
+        simulation.update_inputs()
+        simulation.settle()
+
+        components[0].state = True
+        simulation.update_inputs()
+        # input, line, output and a final step without changes
+        assert simulation.settle() == 4
+        assert np.all(simulation.output == [1, 1, 1, 0])
+        assert simulation.settle() == 1
+        # a bounded number of steps
+        components[0].state = False
+        simulation.update_inputs()
+        assert simulation.settle(2) == 2
+        assert np.all(simulation.output == [0, 0, 1, 0])
+
+    def test_backends(self, _init_pygame, default_ui_manager, _display_surface_return_none, backend):
+        # a circuit with feedback and a wide gate, every backend must produce the same sequence of states
+        simulations = [self.random_circuit(8, 300, seed=5) for _ in backends]
+        for name, simulation in zip(backends, simulations):
+            simulation.backend = simulator.backends.get_backend(name)
+            self.ring(simulation, [100, 150, 200])
+            simulation.wide = np.array([250], dtype=np.int32)
+            simulation.wide_ptr = np.array([0, 3], dtype=np.int32)
+            simulation.wide_inputs = np.array([10, 100, 150], dtype=np.int32)
+            simulation.wide_reduction = np.array([1], dtype=np.uint8)
+            simulation._build_indices()
+            simulation.components[3].state = True
+            simulation.update_inputs()
+        for _ in range(20):
+            changed = [simulation.simulate_np() for simulation in simulations]
+            assert len(set(changed)) == 1
+            for simulation in simulations[1:]:
+                assert np.array_equal(simulation.output, simulations[0].output)
+        steps = [simulation.settle(7) for simulation in simulations]
+        assert steps == [7] * len(simulations)
+        assert not any(simulation.settled for simulation in simulations)
+
+        with pytest.raises(ValueError):
+            Simulation([], backend="magic")
+
+        # a backend must at least implement step()
+        class Incomplete(simulator.backends.Backend):
+            pass
+
+        with pytest.raises(TypeError):
+            Incomplete()
+
+    def test_netlist(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        simulation = self.random_circuit(5, 150, seed=3)
+        netlist = pickle.loads(pickle.dumps(simulation.netlist()))
+        assert netlist.n == simulation.n
+        copied = Simulation.from_netlist(netlist)
+        assert np.array_equal(copied.fanout, simulation.fanout)
+        stimuli = (np.arange(32)[:, np.newaxis] >> np.arange(5)) & 1
+        assert np.array_equal(copied.run_batch(stimuli), simulation.run_batch(stimuli))
+
+    def test_partition(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        # two independent circuits side by side end up in separate shards
+        first = self.random_circuit(4, 60, seed=1)
+        second = self.random_circuit(4, 60, seed=2)
+        simulation = self.random_circuit(8, 129, seed=3)
+        for name in ("inputmap1", "inputmap2", "operation"):
+            getattr(simulation, name)[:65] = getattr(first, name)[:65]
+            getattr(simulation, name)[65:130] = getattr(second, name)[:65] + (65 if name != "operation" else 0)
+        simulation.inputmap1[130:] = simulation.inputmap2[130:] = np.arange(130, 139)
+        simulation._build_indices()
+        shards = partition(simulation.netlist(), 2)
+        assert len(shards) == 2
+        assert set(range(65)) <= set(shards[0].tolist())
+        assert set(range(65, 130)) <= set(shards[1].tolist())
+
+    def test_sharded_simulation(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        simulation = self.random_circuit(8, 300, seed=7)
+        self.ring(simulation, [100, 150, 200])
+        stimuli = np.arange(8) % 3 == 0
+        simulation.input1[simulation.input_index] = simulation.input2[simulation.input_index] = stimuli
+        with ShardedSimulation(simulation.netlist(), workers=3) as sharded:
+            assert len(sharded.shards) == 3
+            sharded.set_inputs(stimuli)
+            for _ in range(10):
+                assert sharded.step() == simulation.simulate_np()
+                assert np.array_equal(sharded.output, simulation.output)
+                assert np.array_equal(sharded.input1, simulation.input1)
+            assert sharded.settle(50) == simulation.settle(50)
+            assert sharded.settled == simulation.settled
+            assert np.array_equal(sharded.output, simulation.output)
+
+    def test_simulate_faults(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        simulation = Simulation(self.and_gate_circuit(), collapse=True)
+        simulation.connect()
+        report = simulate_faults(simulation, workers=1)
+        # only the gate is left after collapsing
+        assert report.faults.tolist() == [[0, 0], [0, 1]]
+        assert report.coverage == 1.0
+        # stuck-at-0 needs both inputs high, i.e. the last of the 4 patterns
+        assert report.first_pattern.tolist() == [3, 0]
+
+        # a gate whose output nobody reads can never be detected
+        simulation = self.random_circuit(6, 200, seed=11)
+        simulation.inputmap1[-2] = simulation.inputmap2[-2] = 150
+        simulation._build_indices()
+        faults = all_faults(simulation)
+        report = simulate_faults(simulation, faults=faults, workers=1)
+        assert (199, 0) in report.undetected() and (199, 1) in report.undetected()
+        assert "undetected: AndGate" in str(report) or "undetected: NandGate" in str(report)
+        # a single fault at a time with the normal engine gives the same result
+        for (element, value), first in list(zip(faults.tolist(), report.first_pattern))[::37]:
+            detected = -1
+            for index, pattern in enumerate(report.patterns):
+                simulation.input1[:] = simulation.input2[:] = simulation.output[:] = False
+                simulation.input1[:6] = simulation.input2[:6] = pattern
+                operation = simulation.operation[element]
+                simulation.operation[element] = STUCK_AT[value]
+                simulation.settle()
+                simulation.operation[element] = operation
+                output = simulation.output[simulation.output_index].copy()
+                simulation.input1[:] = simulation.input2[:] = simulation.output[:] = False
+                simulation.input1[:6] = simulation.input2[:6] = pattern
+                simulation.settle()
+                if detected < 0 and not np.array_equal(output, simulation.output[simulation.output_index]):
+                    detected = index
+            assert detected == first
+
+        # the same report from a pool of processes, whose workers use the backend that needs no compilation
+        simulator.faults._initialize(simulation.netlist())
+        assert simulator.faults._simulation.backend.name == "numpy"
+        pooled = simulate_faults(simulation, faults=faults, workers=2)
+        assert np.array_equal(pooled.first_pattern, report.first_pattern)
+
+    @pytest.mark.parametrize("engine", ("sync", "event", "levelized"))
+    def test_run(self, _init_pygame, default_ui_manager, _display_surface_return_none, engine):
+        components = [Clock((100, 100), period=4, phase=1), Line((120, 100), (200, 100)), Output((220, 100))]
+        simulation = Simulation(components, engine=engine)
+        simulation.connect()
+        assert simulation.clock_index.tolist() == [0]
+        simulation.update_inputs()
+        simulation.settle()
+        values = []
+        for _ in range(8):
+            simulation.run(1)
+            values.append(bool(simulation.output[2]))
+        assert values == [True, True, False, False, True, True, False, False]
+        # 500 edges in 1000 cycles, the sync engine needs 4 steps for every edge
+        steps = simulation.run(1000)
+        if engine == "sync":
+            assert steps == 2000
+        assert simulation.time == 1008
+        assert components[2].state is False  # run() does not touch the components
+        simulation.update_components()
+        assert components[2].state == bool(simulation.output[2])
+
+    @pytest.mark.parametrize("engine", ("sync", "event", "levelized"))
+    def test_run_after_input_change(self, _init_pygame, default_ui_manager, _display_surface_return_none, engine):
+        # an input that changes between runs reaches the output, also without any clock edge
+        components = [Input((100, 100)), Line((120, 100), (200, 100)), Output((220, 100))]
+        simulation = Simulation(components, engine=engine)
+        simulation.connect()
+        simulation.update_inputs()
+        simulation.settle()
+        components[0].state = True
+        simulation.update_inputs()
+        assert not simulation.settled
+        assert simulation.run(3) > 0
+        assert simulation.settled
+        assert simulation.output[2]
+        # nothing changed, so nothing to do
+        simulation.update_inputs()
+        assert simulation.run(3) == 0
+
+    def test_clock_period(self, _init_pygame, default_ui_manager, _display_surface_return_none):
+        for clock in (Clock, model.Clock):
+            assert clock((100, 100), period=2, phase=0).period == 2
+            with pytest.raises(ValueError):
+                clock((100, 100), period=1)
+            with pytest.raises(ValueError):
+                clock((100, 100), period=0)
+            with pytest.raises(ValueError):
+                clock((100, 100), period=4, phase=-1)
+
+    def test_simulate_np_does_not_allocate(
+        self, _init_pygame, default_ui_manager, _display_surface_return_none
+    ):
+        components = self.chain_of_gates(100)
+        simulation = Simulation(components)
+        simulation.connect()
+        input1, input2 = simulation.input1, simulation.input2
+        buffers = {id(simulation.output), id(simulation._next_output)}
+        simulation.settle()
+        assert simulation.input1 is input1
+        assert simulation.input2 is input2
+        assert {id(simulation.output), id(simulation._next_output)} == buffers
+
+    @pytest.skipifcoverage
+    @pytest.mark.parametrize("n", (1000, 10000, 100000))
+    def test_connect_benchmark(
+        self,
+        _init_pygame,
+        default_ui_manager,
+        _display_surface_return_none,
+        benchmark,
+        n,
+    ):
+        components = self.chain_of_gates(n)
+        simulation = Simulation(components)
+        benchmark.pedantic(simulation.connect, rounds=3)
+
+    @pytest.skipifcoverage
+    def test_connect_scaling(self, _init_pygame, default_ui_manager, _display_surface_return_none, monkeypatch):
+        # the benchmark above measures the time, this checks that the number of hotspots compared grows
+        # linearly up to 100k components, which does not depend on the speed of the machine
+        calls = []
+        overlap = simulator.connections.overlap
+
+        def counted(*args):
+            calls[-1] += 1
+            return overlap(*args)
+
+        monkeypatch.setattr(simulator.connections, "overlap", counted)
+        for n in (10000, 100000):
+            calls.append(0)
+            components = self.chain_of_gates(n)
+            simulation = Simulation(components)
+            simulation.connect()
+            assert simulation._hotspots.overlapping(components[-1], 1) == {(components[-2], 0)}
+        assert 0 < calls[1] <= 11 * calls[0]
+
+    @pytest.skipifcoverage
+    @pytest.mark.parametrize("n", (1000, 2000, 3000, 4000))
+    def test_settle_benchmark(
+        self,
+        _init_pygame,
+        default_ui_manager,
+        _display_surface_return_none,
+        benchmark,
+        n,
+    ):
+        components = [AndGate((100, 100)) for i in range(n)]
+        simulation = Simulation(components)
+        simulation.connect()
+        benchmark(simulation.settle, 10)
+
+    @pytest.skipifcoverage
+    @pytest.mark.parametrize("n", (1000, 2000, 3000, 4000))
+    def test_settle_packed_benchmark(
+        self,
+        _init_pygame,
+        default_ui_manager,
+        _display_surface_return_none,
+        benchmark,
+        n,
+    ):
+        # 64 input patterns per call
+        simulation = self.random_circuit(16, n)
+        words = np.random.default_rng(0).integers(0, 2**63, 16, dtype=np.uint64)
+        benchmark(simulation.settle_packed, words)
+
+    @pytest.skipifcoverage
+    @pytest.mark.parametrize("engine", ("sync", "event", "levelized"))
+    def test_toggle_benchmark(
+        self,
+        _init_pygame,
+        default_ui_manager,
+        _display_surface_return_none,
+        benchmark,
+        engine,
+    ):
+        # a click on a single input of a large circuit
+        simulation = self.random_circuit(64, 20000)
+        simulation.engine = engine
+        simulation.update_inputs()
+        simulation.settle()
+
+        def toggle():
+            simulation.components[0].toggle()
+            simulation.update_inputs()
+            simulation.settle()
+
+        benchmark(toggle)
+
+    @pytest.skipifcoverage
+    @pytest.mark.parametrize("n", (1000, 2000, 3000, 4000))
+    def test_run_batch_benchmark(
+        self,
+        _init_pygame,
+        default_ui_manager,
+        _display_surface_return_none,
+        benchmark,
+        n,
+    ):
+        # a truth table of 10 inputs
+        simulation = self.random_circuit(10, n)
+        stimuli = (np.arange(1024)[:, np.newaxis] >> np.arange(10)) & 1
+        benchmark(simulation.run_batch, stimuli)
+
+    @pytest.skipifcoverage
+    @pytest.mark.parametrize("engine", ("sync", "event", "levelized"))
+    def test_run_benchmark(
+        self,
+        _init_pygame,
+        default_ui_manager,
+        _display_surface_return_none,
+        benchmark,
+        engine,
+    ):
+        # 1000 cycles of a clock that drives one of the inputs of a large circuit
+        simulation = self.random_circuit(64, 20000)
+        simulation.engine = engine
+        simulation.clock_index = simulation.input_index[:1]
+        simulation.clock_period = np.array([2], dtype=np.int64)
+        simulation.clock_phase = np.array([0], dtype=np.int64)
+        simulation.update_inputs()
+        simulation.settle()
+        benchmark(simulation.run, 1000)
+
+    @pytest.skipifcoverage
+    def test_update_components_benchmark(
+        self,
+        _init_pygame,
+        default_ui_manager,
+        _display_surface_return_none,
+        benchmark,
+    ):
+        # a click on a single input of a 50k component circuit, including copying the result to the components
+        simulation = self.random_circuit(64, 50000)
+        simulation.engine = "event"
+        simulation.update_inputs()
+        simulation.settle()
+        simulation.update_components()
+
+        def toggle():
+            simulation.components[0].toggle()
+            simulation.update_inputs()
+            simulation.settle()
+            return simulation.update_components()
+
+        assert simulation.components[0] in toggle()
+        benchmark(toggle)
+
     # @pytest.mark.skipif(
     #     pytest.coverage,
     #     reason="--cov slows down benchmarks tremendously",